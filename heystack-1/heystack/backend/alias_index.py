@@ -0,0 +1,86 @@
+from collections import deque
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+# --- Aho-Corasick alias index ---
+# One automaton over every alias, song title and song keyword. A message is
+# resolved to the entities it mentions in a single pass over its characters,
+# however many aliases are indexed.
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class AliasIndex:
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per node: (entity, phrase length, whole_word) for every phrase ending here
+        self._out: List[List[Tuple[str, int, bool]]] = [[]]
+        self._built = False
+        self.size = 0
+
+    def add(self, phrase: str, entity: str, whole_word: bool = True) -> None:
+        """Index `phrase`; whole_word phrases only match between word boundaries (like \\b...\\b)."""
+        node = 0
+        for ch in phrase.lower():
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((entity, len(phrase), whole_word))
+        self._built = False
+        self.size += 1
+
+    def build(self) -> "AliasIndex":
+        queue = deque(self._goto[0].values())
+        for child in queue:
+            self._fail[child] = 0
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+                queue.append(child)
+        self._built = True
+        return self
+
+    def find(self, text: str) -> Iterator[Tuple[str, int, int]]:
+        """Yield (entity, start, end) for every indexed phrase in the lowercased `text`."""
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for entity, length, whole_word in out[node]:
+                start, end = i + 1 - length, i + 1
+                if whole_word and ((start > 0 and _is_word_char(text[start - 1])) or
+                                   (end < len(text) and _is_word_char(text[end]))):
+                    continue
+                yield entity, start, end
+
+    def entities(self, text: str) -> Set[str]:
+        return {entity for entity, _, _ in self.find(text)}
+
+
+def build_alias_index(keyword_map: Dict[str, Dict[str, Any]], song_map: Dict[str, Dict[str, Any]]) -> AliasIndex:
+    index = AliasIndex()
+    for entity, data in keyword_map.items():
+        for alias in data.get("aliases", []):
+            index.add(alias, entity)
+    for song_id, song in song_map.items():
+        index.add(song["title"], song_id)
+        # Song keywords keep the old substring semantics ("1" in "option 1")
+        for keyword in song.get("keywords", []):
+            index.add(keyword, song_id, whole_word=False)
+    return index.build()
@@ -0,0 +1,50 @@
+"""
+Build the knowledge-base retrieval index offline.
+
+    python backend/build_index.py [--engine tfidf|bm25] [--kb DIR] [--out DIR]
+
+Fits the retriever on the KB files under data/ (streamed, see kb_loader.py)
+and writes it to data/oud_knowledge.index, which action.py memory-maps at
+start-up instead of refitting in every worker. Rebuild after editing the
+knowledge base: an index whose KB file sizes or mtimes no longer match is
+ignored.
+"""
+import argparse
+import os
+import sys
+import time
+
+from knowledge import KnowledgeBase
+from retrieval import ENGINES, load_index, save_index
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the knowledge-base retrieval index.")
+    parser.add_argument("--engine", default=os.environ.get("RETRIEVAL_ENGINE", "tfidf"), choices=sorted(ENGINES))
+    parser.add_argument("--kb", default=os.environ.get("KB_DIR", os.path.join(APP_ROOT, "data")))
+    parser.add_argument("--out", default=os.environ.get("KB_INDEX", os.path.join(APP_ROOT, "data", "oud_knowledge.index")))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    retriever = KnowledgeBase(args.kb, args.engine).load().retriever
+    fitted = time.perf_counter()
+    paragraphs = retriever.paragraphs
+    if not paragraphs:
+        print(f"{args.kb} has no paragraphs, nothing to index")
+        sys.exit(1)
+
+    save_index(retriever, args.engine, args.out, args.kb)
+    saved = time.perf_counter()
+    load_index(args.out)
+    loaded = time.perf_counter()
+
+    size = sum(e.stat().st_size for e in os.scandir(args.out))
+    print(f"{args.engine} index of {len(paragraphs)} paragraphs, {len(retriever.vocabulary)} terms -> {args.out}")
+    print(f"fit {fitted - start:.2f}s, write {saved - fitted:.2f}s, {size / 1e6:.1f} MB, "
+          f"load {(loaded - saved) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Transcode the frontend media into compact variants offline.
+
+    python backend/build_media.py [--static DIR] [--force]
+
+Every audio file under frontend/static gets Opus (.opus) and AAC (.m4a)
+encodings, made with ffmpeg; every image gets WebP copies resized to the
+widths in IMAGE_WIDTHS (never upscaled), made with Pillow. The results go to
+frontend/static/variants/ along with manifest.json, which media.py reads at
+start-up: replies then offer the variants (<source> elements, srcset) ahead
+of the original, smallest first. A variant no smaller than its original is
+dropped. Rebuild after replacing an asset: manifest entries whose source
+size or mtime no longer match are ignored. Without ffmpeg or Pillow the
+corresponding assets are skipped, and replies keep using the originals.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from media import (AUDIO_SUFFIXES, FRONTEND_DIR, IMAGE_SUFFIXES, MEDIA_MANIFEST, VARIANTS_DIR, source_matches)
+
+# (extension, MIME type, ffmpeg codec arguments); tuning samples are one plucked string, so mono is enough
+AUDIO_FORMATS = [
+    (".opus", "audio/ogg; codecs=opus", ["-c:a", "libopus", "-b:a", "48k", "-ac", "1"]),
+    (".m4a", "audio/mp4", ["-c:a", "aac", "-b:a", "64k", "-ac", "1", "-movflags", "+faststart"]),
+]
+# Chat bubbles show images at most ~360 CSS px wide: 1x, 2x and 3x screens
+IMAGE_WIDTHS = (360, 720, 1080)
+WEBP_QUALITY = 80
+
+
+def _rel(path: str) -> str:
+    return os.path.relpath(path, FRONTEND_DIR).replace(os.sep, "/")
+
+
+def _out_path(rel: str, suffix: str) -> str:
+    # static/audio/C2.wav -> static/variants/audio/C2.opus
+    inner = os.path.splitext(os.path.relpath(rel, "static"))[0]
+    return os.path.join(VARIANTS_DIR, inner + suffix)
+
+
+def transcode_audio(path: str, rel: str) -> list:
+    variants = []
+    for suffix, media_type, codec in AUDIO_FORMATS:
+        out = _out_path(rel, suffix)
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        subprocess.run(["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", path, "-vn", *codec, out],
+                       check=True)
+        variants.append({"path": _rel(out), "type": media_type, "bytes": os.path.getsize(out)})
+    return variants
+
+
+def transcode_image(path: str, rel: str) -> tuple:
+    from PIL import Image
+
+    variants = []
+    with Image.open(path) as image:
+        image.load()
+        width, height = image.size
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        for target in sorted({min(w, width) for w in IMAGE_WIDTHS}):
+            out = _out_path(rel, f".{target}w.webp")
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            resized = image if target == width else image.resize((target, round(height * target / width)),
+                                                                 Image.LANCZOS)
+            resized.save(out, "WEBP", quality=WEBP_QUALITY, method=6)
+            variants.append({"path": _rel(out), "type": "image/webp", "width": target,
+                             "bytes": os.path.getsize(out)})
+    return variants, width
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcode frontend media into compact variants.")
+    parser.add_argument("--static", default=os.path.join(FRONTEND_DIR, "static"))
+    parser.add_argument("--force", action="store_true", help="re-encode assets whose variants are up to date")
+    args = parser.parse_args()
+
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+    have_pillow = importlib.util.find_spec("PIL") is not None
+    if not have_ffmpeg:
+        print("ffmpeg not found: audio is left as is")
+    if not have_pillow:
+        print("Pillow not installed (pip install pillow): images are left as is")
+
+    previous = {}
+    if os.path.exists(MEDIA_MANIFEST) and not args.force:
+        with open(MEDIA_MANIFEST, "r", encoding="utf-8") as f:
+            previous = json.load(f).get("assets", {})
+
+    assets = {}
+    start = time.perf_counter()
+    for dirpath, dirnames, filenames in os.walk(args.static):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".")
+                             and os.path.abspath(os.path.join(dirpath, d)) != os.path.abspath(VARIANTS_DIR))
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            rel = _rel(path)
+            lower = name.lower()
+            old = previous.get(rel)
+            if old is not None and source_matches(old, path):
+                assets[rel] = old
+                continue
+            st = os.stat(path)
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            if lower.endswith(AUDIO_SUFFIXES) and have_ffmpeg:
+                variants = transcode_audio(path, rel)
+            elif lower.endswith(IMAGE_SUFFIXES) and have_pillow:
+                variants, entry["width"] = transcode_image(path, rel)
+            else:
+                continue
+            kept = [v for v in variants if v["bytes"] < st.st_size]
+            for v in variants:
+                if v not in kept:
+                    os.remove(os.path.join(FRONTEND_DIR, v["path"]))
+            entry["variants"] = sorted(kept, key=lambda v: v["bytes"])
+            assets[rel] = entry
+            saved = st.st_size - (min(v["bytes"] for v in kept) if kept else st.st_size)
+            print(f"{rel}: {len(kept)} variants, smallest saves {saved / 1e3:.0f} kB")
+
+    if not assets:
+        print("nothing transcoded")
+        sys.exit(1)
+    os.makedirs(VARIANTS_DIR, exist_ok=True)
+    tmp = MEDIA_MANIFEST + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"assets": assets}, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    os.replace(tmp, MEDIA_MANIFEST)
+
+    before = sum(a["size"] for a in assets.values())
+    after = sum(min([v["bytes"] for v in a["variants"]] + [a["size"]]) for a in assets.values())
+    print(f"{len(assets)} assets, {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB smallest variants "
+          f"in {time.perf_counter() - start:.1f}s -> {MEDIA_MANIFEST}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+from alias_index import build_alias_index
+
+# --- Keyword Knowledge Map ---
+SONG_VIDEO_MAP = {
+    "song1": {
+        "title": "Noura Ya Noura - An Easy Oud Song by Farid Al-Atrash",
+        "keywords": ["noura", "1"],
+        "url": "https://www.youtube.com/embed/jhVzW8jbhDE?list=RDjhVzW8jbhDE&start_radio=1"
+    },
+    "song2": {
+        "title": "Learn Leila by Farid Al-Atrash on Oud - Easy Oud Songs",
+        "keywords": ["leila", "layla", "2"],
+        "url": "https://www.youtube.com/embed/rysHoKWqGAs?list=RDrysHoKWqGAs&start_radio=1"
+    }
+}
+
+KEYWORD_DATA_MAP = {
+    "farid": {
+        "aliases": ["al-atrash","al atrash", "alatrash", "the musician", "the oud player"],
+        "image": "static/farid-al-atrash.jpeg",
+        "facts": [
+            "Farid Al-Atrash was known as 'the King of the Oud'.",
+            "Syrian-Egyptian singer, actor, and oud master",
+            "He moved to Egypt as a child and became one of the most influential figures in Arabic music."
+        ],
+    },
+
+    "oud_picture": {
+        "aliases": [
+            "show oud", "picture of oud", "show me oud",
+            "how oud looks", "oud photo", "image of oud", "image", "picture", "it's image", "it's picture",
+            "show me oud", "picture of oud", "how oud looks like", "it's photo", "photo", "it's picture"
+        ],
+        # 👇 you’ll write your own image path here
+        "images": ["static/images/Oud_Picture_1.webp"],
+        "facts": [
+            "The Oud is a pear-shaped string instrument widely used in Middle Eastern music.",
+            "It is often considered the ancestor of the European lute."
+        ]
+    },
+    "oud_structure": {
+        "aliases": [
+            "oud structure", "parts of oud", "oud diagram",
+            "oud anatomy", "structure of oud", 'the structure'
+        ],
+        # 👇 you’ll also write your own structure image path
+        "images": ["static/images/Oud_Picture_2.jfif"],
+        "facts": [
+            "The Oud’s main parts include the soundboard, soundholes, bridge, neck, and pegbox.",
+            "It has 11 strings grouped in 5 or 6 courses and has no frets, allowing smooth slides."
+        ]
+    },
+    "oud_audio": {
+        "aliases": [
+            "sound of oud", "oud audio", "how oud sounds",
+            "oud tone", "listen to oud", "hear oud"
+        ],
+        "audio_files": ["static/audio/oud_sample.mp3"],
+        "facts": [
+            "Here’s how the Oud sounds — warm, deep, and expressive. 🎵",
+            "Its unique timbre comes from its fretless design and hollow body."
+        ]
+    },
+
+    "oud_professional": {
+        "images": ["static/images/professional.png"],
+        "facts": ["A professional Oud usually has a spruce top and a walnut or mahogany body for a rich, deep tone."]
+    },
+    "oud_beginner": {
+        "aliases": ["oud for beginners","oud for beginners", "beginner"],
+        "images": ["static/images/beginner.png"],
+        "facts": ["A beginner’s Oud has nylon strings and lighter wood, making it easier to play for new learners."]
+    },
+
+
+}
+
+# --- Alias index (built once at startup) ---
+ALIAS_INDEX = build_alias_index(KEYWORD_DATA_MAP, SONG_VIDEO_MAP)
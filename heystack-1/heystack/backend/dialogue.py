@@ -0,0 +1,121 @@
+from collections import defaultdict
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+# --- Dialogue engine ---
+# A conversation is driven by a transition table keyed on (state, intent).
+# States are named predicates over the session (awaiting_name,
+# awaiting_song_choice, awaiting_string_audio, ...); several can be active at
+# once. For each turn the engine only looks at the buckets for the active
+# states (plus the stateless None bucket), under the detected intent and
+# under ANY, so dispatch cost does not grow with the number of flows.
+#
+# Special intents:
+#   OPEN — the empty first message sent when the chat window loads
+#   RAW  — tried before intent detection; lets a state consume free text
+#   ANY  — matches whatever intent was detected (never OPEN or RAW)
+OPEN = "<open>"
+RAW = "<raw>"
+ANY = "*"
+
+Handler = Callable[["Turn"], Optional[Sequence[str]]]
+
+
+class Turn:
+    """One incoming message and the session it belongs to."""
+
+    __slots__ = ("sender", "text", "lower", "session", "intent", "now")
+
+    def __init__(self, sender: str, text: str, session: Dict[str, Any], now: Optional[datetime] = None):
+        self.sender = sender
+        self.text = text
+        self.lower = text.lower().strip()
+        self.session = session
+        self.intent: Optional[str] = None
+        self.now = now or datetime.now()
+
+
+class Transition(NamedTuple):
+    state: Optional[str]  # None: applies whatever state the session is in
+    intent: str
+    handler: Handler
+    guard: Optional[Callable[[Turn], bool]] = None
+
+
+class DialogueEngine:
+    """
+    Transitions are tried in declaration order among those whose bucket is
+    live for the turn; the first whose guard passes and whose handler returns
+    a sequence of responses wins. A handler may return None to let the turn fall
+    through to the next candidate. run() returns None when nothing handled
+    the turn, leaving the fallback to the caller.
+    """
+
+    def __init__(self, states: Dict[str, Callable[[Dict[str, Any]], Any]],
+                 transitions: List[Transition],
+                 detect_intent: Callable[[str, Dict[str, Any]], str],
+                 before_dispatch: Optional[Callable[[Turn], None]] = None):
+        self.states = states
+        self.detect_intent = detect_intent
+        self.before_dispatch = before_dispatch
+        self.table: Dict[Tuple[Optional[str], str], List[Tuple[int, Transition]]] = defaultdict(list)
+        for seq, transition in enumerate(transitions):
+            if transition.state is not None and transition.state not in states:
+                raise ValueError(f"transition for unknown state: {transition.state}")
+            self.table[(transition.state, transition.intent)].append((seq, transition))
+        self.table = dict(self.table)
+        # observe(stage, seconds), if set, is told how long each turn spent in "detect_intent" and "dispatch"
+        self.observe: Optional[Callable[[str, float], None]] = None
+
+    def active_states(self, session: Dict[str, Any]) -> List[str]:
+        return [name for name, predicate in self.states.items() if predicate(session)]
+
+    def dispatch(self, turn: Turn, intent: str) -> Optional[Sequence[str]]:
+        wildcard = intent not in (OPEN, RAW)  # ANY only stands for detected intents
+        keys = [(None, intent), (None, ANY)] if wildcard else [(None, intent)]
+        for state in self.active_states(turn.session):
+            keys.append((state, intent))
+            if wildcard:
+                keys.append((state, ANY))
+        candidates = sorted(c for key in keys for c in self.table.get(key, ()))
+        for _, transition in candidates:
+            if transition.guard is not None and not transition.guard(turn):
+                continue
+            responses = transition.handler(turn)
+            if responses is not None:
+                return responses
+        return None
+
+    def run(self, turn: Turn) -> Optional[Sequence[str]]:
+        if self.observe is None:
+            return self._run(turn, None)
+        start = perf_counter()
+        detecting: List[float] = []  # filled only if the turn gets as far as intent detection
+        responses = self._run(turn, detecting)
+        elapsed = perf_counter() - start
+        if detecting:
+            self.observe("detect_intent", detecting[0])
+            elapsed -= detecting[0]
+        self.observe("dispatch", elapsed)
+        return responses
+
+    def _run(self, turn: Turn, detecting: Optional[List[float]]) -> Optional[Sequence[str]]:
+        if turn.lower == "":
+            turn.intent = OPEN
+            return self.dispatch(turn, OPEN)
+
+        responses = self.dispatch(turn, RAW)
+        if responses is not None:
+            return responses
+
+        if detecting is None:
+            turn.intent = self.detect_intent(turn.text, turn.session)
+        else:
+            start = perf_counter()
+            turn.intent = self.detect_intent(turn.text, turn.session)
+            detecting.append(perf_counter() - start)
+        turn.session["last_intent"] = turn.intent
+        if self.before_dispatch is not None:
+            self.before_dispatch(turn)
+        return self.dispatch(turn, turn.intent)
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# --- Sentence embeddings ---
+# Model side of the "dense" retrieval engine (RETRIEVAL_ENGINE=dense). The
+# sentence-transformers model is loaded on first use, pinned to the CPU, and
+# shared by every retriever built in the process, so a KB reload neither
+# reloads the model nor loses the query cache.
+#
+# Query embeddings go through a QueryEmbedder:
+#   - an LRU cache keyed by the normalised question (lowercase, whitespace
+#     collapsed), so a repeated question never reaches the model;
+#   - micro-batching: the first lookup to miss the cache waits `window`
+#     seconds (or until max_batch lookups are queued) and encodes every
+#     question queued by then in one model call. Concurrent lookups of the
+#     same question share one slot in the batch.
+
+DEFAULT_MODEL = os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+BATCH_WINDOW = float(os.environ.get("EMBEDDING_BATCH_WINDOW_MS", "5")) / 1000
+MAX_BATCH = int(os.environ.get("EMBEDDING_MAX_BATCH", "32"))
+CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "4096"))
+# Paragraphs per model call while embedding the knowledge base
+PARAGRAPH_BATCH = 256
+
+
+def normalise_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def load_model(name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name, device="cpu")
+
+
+class QueryEmbedder:
+    """L2-normalised float32 embeddings from one model, with the query cache and micro-batcher described above."""
+
+    def __init__(self, model_name: str, window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH,
+                 cache_size: int = CACHE_SIZE, model_loader: Callable[[str], Any] = load_model):
+        self.model_name = model_name
+        self.window = window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self._model_loader = model_loader
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._collecting = False
+        self._lock = threading.Lock()
+        self._batch_full = threading.Condition(self._lock)
+        # paragraph hash -> embedding row of the last KB embedded, reused by the next reload
+        self._paragraphs: Dict[bytes, np.ndarray] = {}
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched = 0
+        self.largest_batch = 0
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                self._model = self._model_loader(self.model_name)
+            return self._model
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        return self.model.encode(list(texts), batch_size=64, normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32, copy=False)
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    # --- Queries ---
+    def embed(self, text: str) -> np.ndarray:
+        key = normalise_query(text)
+        with self._lock:
+            vector = self._cached(key)
+            if vector is not None:
+                return vector
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = Future()
+                if len(self._pending) >= self.max_batch:
+                    self._batch_full.notify()
+            lead = not self._collecting
+            self._collecting = True
+        if lead:
+            self._run_batches()
+        return future.result()
+
+    def embed_many(self, texts: Sequence[str]) -> np.ndarray:
+        """Embeddings of `texts` in one model call for the cache misses, without waiting for a batch window."""
+        keys = [normalise_query(text) for text in texts]
+        with self._lock:
+            found = {key: self._cached(key) for key in keys}
+        missing = [key for key, vector in found.items() if vector is None]
+        if missing:
+            self._store(missing, self.encode(missing))
+            with self._lock:
+                found.update((key, self._cache.get(key)) for key in missing)
+            # Evicted already (cache smaller than the batch): encode those alone
+            for key in [key for key in missing if found[key] is None]:
+                found[key] = self.encode([key])[0]
+        return np.stack([found[key] for key in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+
+    def _cached(self, key: str) -> Optional[np.ndarray]:
+        # Caller holds self._lock
+        vector = self._cache.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return vector
+
+    def _store(self, keys: Sequence[str], vectors: np.ndarray) -> None:
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._cache[key] = vector
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _run_batches(self) -> None:
+        # The leader encodes batches until nothing is left pending, then steps down
+        while True:
+            with self._lock:
+                self._batch_full.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.window)
+                batch: List[Tuple[str, Future]] = list(self._pending.items())[:self.max_batch]
+                for key, _ in batch:
+                    del self._pending[key]
+                if not batch:
+                    self._collecting = False
+                    return
+            keys = [key for key, _ in batch]
+            try:
+                vectors = self.encode(keys)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self._store(keys, vectors)
+            with self._lock:
+                self.batches += 1
+                self.batched += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    # --- Knowledge base ---
+    def embed_paragraphs(self, paragraphs: Sequence[str]) -> np.ndarray:
+        """(len(paragraphs), dimension) matrix; paragraphs unchanged since the previous call are not re-encoded."""
+        keys = [hashlib.blake2b(p.encode("utf-8"), digest_size=16).digest() for p in paragraphs]
+        matrix = np.empty((len(paragraphs), self.dimension if paragraphs else 0), dtype=np.float32)
+        todo = [i for i, key in enumerate(keys) if key not in self._paragraphs]
+        for start in range(0, len(todo), PARAGRAPH_BATCH):
+            rows = todo[start:start + PARAGRAPH_BATCH]
+            matrix[rows] = self.encode([paragraphs[i] for i in rows])
+        reused = set(range(len(keys))).difference(todo)
+        for i in reused:
+            matrix[i] = self._paragraphs[keys[i]]
+        self._paragraphs = {key: matrix[i] for i, key in enumerate(keys)}
+        return matrix
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "cache_entries": len(self._cache),
+            "cache_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "batches": self.batches,
+            "mean_batch": round(self.batched / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+        }
+
+
+_embedders: Dict[str, QueryEmbedder] = {}
+_embedders_lock = threading.Lock()
+
+
+def query_embedder(model_name: str = DEFAULT_MODEL) -> QueryEmbedder:
+    """The process-wide embedder for model_name."""
+    with _embedders_lock:
+        if model_name not in _embedders:
+            _embedders[model_name] = QueryEmbedder(model_name)
+        return _embedders[model_name]
@@ -0,0 +1,628 @@
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from catalog import ALIAS_INDEX, KEYWORD_DATA_MAP, SONG_VIDEO_MAP
+from dialogue import ANY, OPEN, RAW, DialogueEngine, Transition, Turn
+from intents import detect_intent
+from media import MEDIA, media_url
+from replies import StaticReply
+
+# --- Conversation flows ---
+# Every response the bot can give, wired into the dialogue engine by the
+# TRANSITIONS table at the bottom of this file. Replies that are the same for
+# every user are StaticReply constants built once at import; handlers only
+# update the session and pick one.
+
+FALLBACK_REPLY = ("I’m not sure I understood. Could you rephrase that, or would you like to explore "
+                  "the Oud’s History, Structure, Audio, or Image?")
+# When the knowledge-base lookup is saturated or too slow to wait for
+BUSY_REPLY = "I’m answering a lot of questions right now 🎵 Could you ask me that again in a moment?"
+# Knowledge questions asked while the retriever is still warming up after a (re)start
+WARMING_UP_REPLY = "I’m still tuning my strings 🎵 Could you ask me that again in a few seconds?"
+
+IMG_STYLE = "max-width:100%;border-radius:10px;margin-top:10px;"
+# Display width of a chat-bubble image, for picking among its resized variants
+IMG_SIZES = "360px"
+
+
+def new_session() -> Dict[str, Any]:
+    # Added last_topic to remember when Farid was discussed
+    return {"user_name": None,
+            "awaiting_name": True,
+            "learning_topic": None,
+            "last_topic": None}
+
+
+# --- Name extraction (graceful handling if skipped) ---
+def extract_name(text: str) -> str:
+    text = text.strip()
+    if not text:
+        return ""
+    lower = text.lower()
+
+    # If user doesn’t want to share name
+    if any(p in lower for p in ["don't want", "prefer not", "skip", "no name"]):
+        return "friend"
+
+    # 1. Look for patterns like "My name is Adam" or "I am Adam"
+    if m := re.search(r"\bmy name is ([A-Za-z][A-Za-z\s'-]{0,30})", text, re.I):
+        return m.group(1).strip().title()
+    if m := re.search(r"\bi(?:'m| am) ([A-Za-z][A-Za-z\s'-]{0,30})", text, re.I):
+        return m.group(1).strip().title()
+
+    # 2. If it's just a single word (like "adam"), take it as the name
+    words = text.split()
+    if len(words) == 1 and words[0].isalpha():
+        return words[0].title()
+
+    return ""
+
+
+# --- Shared response blocks ---
+# Media tags offer the compact variants from build_media.py when they exist: resized WebP in a srcset (the browser
+# fetches the smallest that fills the slot) and Opus/AAC sources ahead of the original audio. Without a build they are
+# plain tags for the original file.
+def _img(src: str, style: str, alt: Optional[str] = None, sizes: str = IMG_SIZES) -> str:
+    alt_attr = f' alt="{alt}"' if alt is not None else ""
+    tag = f'<img src="{media_url(src)}"{alt_attr} style="{style}">'
+    resized = sorted((v for v in MEDIA.variants(src) if "width" in v), key=lambda v: v["width"])
+    if not resized:
+        return tag
+    srcset = ", ".join(f'{media_url(v["path"])} {v["width"]}w' for v in resized)
+    return f'<picture><source type="image/webp" srcset="{srcset}" sizes="{sizes}">{tag}</picture>'
+
+
+def _audio(src: str, attrs: str = "") -> str:
+    variants = MEDIA.variants(src)
+    if not variants:
+        return f'<audio controls src="{media_url(src)}"{attrs}></audio>'
+    sources = "".join(f'<source src="{media_url(v["path"])}" type="{v["type"]}">' for v in variants)
+    return f'<audio controls{attrs}>{sources}<source src="{media_url(src)}"></audio>'
+
+
+def _images(key: str, alt: str) -> List[str]:
+    return [_img(img, IMG_STYLE, alt) for img in KEYWORD_DATA_MAP[key]["images"]]
+
+
+def _farid_card() -> List[str]:
+    data = KEYWORD_DATA_MAP["farid"]
+    responses = ["Here’s **Farid Al-Atrash**, the legendary King of the Oud! 🎶"]
+    if data["image"]:
+        responses.append(_img(data["image"], IMG_STYLE, "Farid Al-Atrash"))
+    return responses + data["facts"]
+
+
+def _professional_oud(intro: str) -> StaticReply:
+    return StaticReply([intro] + _images("oud_professional", "Professional Oud")
+                       + KEYWORD_DATA_MAP["oud_professional"]["facts"])
+
+
+def _beginner_oud(intro: str) -> StaticReply:
+    return StaticReply([intro] + _images("oud_beginner", "Beginner Oud") + KEYWORD_DATA_MAP["oud_beginner"]["facts"])
+
+
+def _video(url: str) -> str:
+    return f'<iframe width="100%" height="200" src="{url}" frameborder="0" allowfullscreen></iframe>'
+
+
+# --- Opening and name capture ---
+GREETINGS = {
+    greeting: StaticReply([f"{greeting}! I am Al-Atrash, your guide to the world of the Oud. 🎵",
+                           "May I know your name? (You can type 'skip' if you prefer not to share)"])
+    for greeting in ["Good Morning", "Good Afternoon", "Good Evening", "Are you still waking up yet?"]
+}
+NAME_NOT_CAUGHT = StaticReply(["I didn’t quite catch your name. Could you please tell me again?"])
+NAME_SKIPPED = StaticReply(["No problem! I'll call you my friend 🎵",
+                            "Would you like to begin with understanding the Oud or how to play it?"])
+
+
+def greet_on_open(turn: Turn) -> Sequence[str]:
+    hour = turn.now.hour
+    if 5 <= hour < 12:
+        greeting = "Good Morning"
+    elif 12 <= hour < 18:
+        greeting = "Good Afternoon"
+    elif 18 <= hour < 24:
+        greeting = "Good Evening"
+    else:
+        greeting = "Are you still waking up yet?"
+
+    turn.session["awaiting_name"] = True
+    return GREETINGS[greeting]
+
+
+def capture_name(turn: Turn) -> Sequence[str]:
+    name = extract_name(turn.text)
+    if not name:
+        return NAME_NOT_CAUGHT
+
+    session = turn.session
+    session["user_name"] = name
+    session["awaiting_name"] = False
+    session["learning_topic"] = None
+    if name.lower() == "friend":
+        return NAME_SKIPPED
+    return [f"Nice to meet you, {name}! 🎶",
+            f"Would you like to begin with understanding the Oud or how to play it, {name}?"]
+
+
+# --- Songs ---
+SONG_REPLIES = {
+    song_id: StaticReply([f"Excellent choice! Here's **{song['title']}** 🎵", _video(song["url"])])
+    for song_id, song in SONG_VIDEO_MAP.items()
+}
+CHOOSE_FROM_LIST = StaticReply(["Please choose 1 or 2 from the list above 🎶"])
+SONG_LIST = StaticReply(["Great! Which song would you like to learn? 🎶",
+                         f"1️⃣ {SONG_VIDEO_MAP['song1']['title']}",
+                         f"2️⃣ {SONG_VIDEO_MAP['song2']['title']}"])
+WHICH_SONG = StaticReply(["Great! Which song would you like to learn? 🎶"])
+
+
+def pick_song(turn: Turn) -> Sequence[str]:
+    mentioned = ALIAS_INDEX.entities(turn.lower)
+    song_id = next((song_id for song_id in SONG_VIDEO_MAP if song_id in mentioned), None)
+    if not song_id:
+        return CHOOSE_FROM_LIST
+
+    turn.session["awaiting_song_choice"] = False
+    return SONG_REPLIES[song_id]
+
+
+def list_songs(turn: Turn) -> Sequence[str]:
+    turn.session["video_watched"] = True
+    turn.session["awaiting_song_choice"] = True
+    return SONG_LIST
+
+
+def famous_song(turn: Turn) -> Sequence[str]:
+    turn.session["learning_topic"] = "famous_song"
+    return WHICH_SONG
+
+
+# --- About the Oud ---
+HISTORY = StaticReply(["The Oud is one of the oldest string instruments, dating back over 5,000 years. 🎶",
+                       "It originated in Mesopotamia and evolved into the modern Oud we know in Arabic music today."])
+CONTINUE_EXPLORING = StaticReply(["Let's continue exploring the Oud 🎶",
+                                  "Would you like to learn its History, Structure, Audio or it's image?"])
+EXPLORE = StaticReply(["Let's explore the Oud together! 🎶",
+                       "Would you like to learn its History, Structure, Audio or it's image?"])
+STRUCTURE = StaticReply(["Here’s the structure of the Oud 🎶"] + _images("oud_structure", "Oud structure")
+                        + KEYWORD_DATA_MAP["oud_structure"]["facts"])
+AUDIO = StaticReply(KEYWORD_DATA_MAP["oud_audio"]["facts"]
+                    + [_audio(audio, ' style="margin-top:10px;"')
+                       for audio in KEYWORD_DATA_MAP["oud_audio"]["audio_files"]])
+PICTURE = StaticReply(["Here’s what the Oud looks like 🎵"] + _images("oud_picture", "Oud")
+                      + KEYWORD_DATA_MAP["oud_picture"]["facts"]
+                      + ["Would you like to *buy an Oud*? I can provide you with helpful information before choosing one 🎸"])
+COMPARE_OUD_TYPES = StaticReply([
+    "Here’s how a *beginner Oud* differs from a *professional Oud*, both in appearance and performance 🎶",
+    "🎸 **Design & Craftsmanship:** Beginner Ouds have a simple design made from basic woods, while professional ones feature decorative details and high-quality materials like walnut or rosewood.",
+    "🎵 **Sound Quality:** Beginner Ouds produce lighter tones, while professional ones have a deeper, richer, and more resonant sound.",
+    "🎼 **Playability:** Professional Ouds are smoother and more precise to play, while beginner Ouds are easier to maintain but less sensitive to touch.",
+    "💰 **Price:** Beginner Ouds cost around $100–$300, while professional ones range from $700 to over $3000.",
+    f'<div>{_img("static/images/oud_difference.png", "max-width:220px;border-radius:10px;", sizes="220px")}</div>',
+])
+
+
+def show_history(turn: Turn) -> Sequence[str]:
+    turn.session["last_topic"] = "history"
+    turn.session["learning_topic"] = "about_oud"
+    return HISTORY
+
+
+def continue_exploring(turn: Turn) -> Sequence[str]:
+    turn.session["learning_topic"] = "about_oud"
+    return CONTINUE_EXPLORING
+
+
+def choose_about_oud(turn: Turn) -> Sequence[str]:
+    turn.session["learning_topic"] = "about_oud"
+    return EXPLORE
+
+
+def show_structure(turn: Turn) -> Sequence[str]:
+    turn.session["last_topic"] = "structure"
+    return STRUCTURE
+
+
+def show_audio(turn: Turn) -> Sequence[str]:
+    return AUDIO
+
+
+def show_picture(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_oud_buy_offer"] = True
+    turn.session["last_topic"] = "oud_picture"
+    return PICTURE
+
+
+def compare_oud_types(turn: Turn) -> Sequence[str]:
+    return COMPARE_OUD_TYPES
+
+
+# --- Farid ---
+NAME_ORIGIN = StaticReply([
+    "I'm named **Al-Atrash** after the legendary musician **Farid Al-Atrash** — the King of the Oud. 🎵",
+    "Would you like to see a picture of him?",
+])
+FARID_CARD = StaticReply(_farid_card())
+
+
+def name_origin(turn: Turn) -> Sequence[str]:
+    turn.session["last_topic"] = "farid"
+    turn.session["awaiting_picture"] = True
+    return NAME_ORIGIN
+
+
+def farid_info(turn: Turn) -> Sequence[str]:
+    return FARID_CARD
+
+
+def farid_picture(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_picture"] = False
+    turn.session["last_topic"] = "farid"
+    return FARID_CARD
+
+
+# --- Buying an Oud ---
+HELP_CHOOSING = StaticReply(["That’s a great question! 🎸 Choosing the right Oud can make a big difference.",
+                             "Would you like me to help you find:",
+                             "1️⃣ The *best Oud to buy* (for quality & sound), or",
+                             "2️⃣ The *most suitable Oud for beginners* to learn on?"])
+HELP_CHOOSING_INLINE = StaticReply([
+    "That’s a great question! 🎸 Choosing the right Oud can make a big difference.",
+    "Would you like me to help you find:\n1️⃣ The *best Oud to buy* (for quality & sound), or\n"
+    "2️⃣ The *most suitable Oud for beginners* to learn on?",
+])
+RECOMMEND_BEST = StaticReply([
+    "If you’re looking for the *best Oud to buy*, consider one made of walnut or mahogany for the body and spruce for the soundboard 🎶",
+    "Brands like *Sukar* or *Gawharet El Fan* are well-known for their quality.",
+    "Would you like me to show what a professional Oud looks like?",
+])
+RECOMMEND_BEGINNER = StaticReply([
+    "If you’re a beginner, look for an Oud with nylon strings — it’s easier on the fingers and great for practice 🎵",
+    "Beginner models from brands like *Sukar* or *Istanbul Oud House* are reliable and affordable.",
+    "Would you like me to show a picture of a beginner’s Oud?",
+])
+PROFESSIONAL_OUD_LOOKS = _professional_oud("Here’s what a *professional Oud* looks like 🎵")
+BEGINNER_OUD_LOOKS = _beginner_oud("Here’s what a *beginner’s Oud* looks like 🎶")
+PROFESSIONAL_OUD = _professional_oud("Here’s a *professional Oud* 🎵")
+BEGINNER_OUD = _beginner_oud("Here’s a *beginner’s Oud* 🎶")
+
+
+def offer_help_choosing(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_oud_buy_offer"] = False
+    turn.session["awaiting_oud_recommendation"] = True
+    turn.session["last_topic"] = "recommendation"
+    return HELP_CHOOSING
+
+
+def offer_help_choosing_inline(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_oud_buy_offer"] = False
+    turn.session["awaiting_oud_recommendation"] = True
+    turn.session["last_topic"] = "recommendation"
+    return HELP_CHOOSING_INLINE
+
+
+def recommend_best(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_oud_recommendation"] = False
+    turn.session["awaiting_professional_oud"] = True
+    return RECOMMEND_BEST
+
+
+def recommend_beginner(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_oud_recommendation"] = False
+    turn.session["awaiting_beginner_oud"] = True
+    return RECOMMEND_BEGINNER
+
+
+def show_professional_oud(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_professional_oud"] = False
+    return PROFESSIONAL_OUD_LOOKS
+
+
+def show_beginner_oud_offer(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_beginner_oud"] = False
+    return BEGINNER_OUD_LOOKS
+
+
+def show_beginner_oud(turn: Turn) -> Sequence[str]:
+    return BEGINNER_OUD_LOOKS
+
+
+def best_oud(turn: Turn) -> Sequence[str]:
+    return PROFESSIONAL_OUD
+
+
+def most_suitable_oud(turn: Turn) -> Sequence[str]:
+    return BEGINNER_OUD
+
+
+# --- Playing ---
+PLAY_MENU = StaticReply(["Wonderful! Let’s begin learning how to play the Oud 🎵",
+                         "Would you like to start with *tuning* or *basic strokes*?",
+                         "Or would you like to learn how to play a *famous song*? 🎵",
+                         "For example: 1️⃣ Noura Ya Noura  2️⃣ Leila"])
+TUNING = StaticReply(["Here’s how you can tune your Oud 🎶",
+                      "Arabic tuning: C2 – F2 – A2 – D3 – G3 – C4",
+                      "Turkish tuning: E2 – A2 – B2 – E3 – A3 – D4",
+                      "Would you like to hear the sound of each string so you can compare your Oud tuning? 🎧"])
+STRING_AUDIO = StaticReply(["Excellent! Let's play each string sound so you can check if yours matches 🎵"]
+                           + [f'{_audio(f"static/audio/{note}.wav")} {note}'
+                              for note in ["C2", "F2", "A2", "D3", "G3", "C4"]])
+SKIP_STRINGS = StaticReply(["No problem! You can always ask me later to play the Oud strings. 🎶"])
+STROKES = StaticReply(["Let’s start with the basic strokes of the Oud 🎶",
+                       "Use a plectrum (risha) and practice alternating up and down strokes on each string."])
+ADVANCED_STROKES = StaticReply([
+    "Alright! Let’s explore some *advanced stroke techniques* 🎶",
+    "Once you’ve mastered the basic alternating strokes, try these:",
+    "🎵 **Tremolo (Risha Rapid)** — rapid up-down strokes for sustained tone.",
+    "🎵 **Double Downstroke** — two quick downstrokes for accent emphasis.",
+    "🎵 **Sweep Stroke** — lightly gliding across multiple strings for a fluid sound.",
+    "Keep your wrist loose — tension kills rhythm! Relax and feel the groove. ✨",
+])
+OFFERED_VIDEO = StaticReply(["Great! Here’s a video tutorial on how to play the Oud 🎶",
+                             _video("https://www.youtube.com/embed/Q0X_Yf9AXAU?si=1dqdP7ISUq2ngSVF")])
+VIDEO = StaticReply(["Here’s a video tutorial on how to play the Oud 🎶",
+                     _video("https://www.youtube.com/embed/H4he47X8CY4?list=RDH4he47X8CY4&start_radio=1")])
+AFTER_VIDEO = StaticReply([
+    "Would you like me to show another Oud playing tutorial or continue with *tuning* or *strokes*? 🎶"
+])
+
+
+def choose_play_oud(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_song_choice"] = True
+    turn.session["learning_topic"] = "play_oud"
+    return PLAY_MENU
+
+
+def show_tuning(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_string_audio"] = True
+    turn.session["last_topic"] = "tuning"
+    return TUNING
+
+
+def play_strings(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_string_audio"] = False
+    return STRING_AUDIO
+
+
+def skip_strings(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_string_audio"] = False
+    return SKIP_STRINGS
+
+
+def show_strokes(turn: Turn) -> Sequence[str]:
+    turn.session["last_topic"] = "strokes"
+    return STROKES
+
+
+def show_advanced_strokes(turn: Turn) -> Sequence[str]:
+    turn.session["last_topic"] = "advanced_strokes"
+    return ADVANCED_STROKES
+
+
+def play_video_offered(turn: Turn) -> Sequence[str]:
+    # 👇 Mark that the video has been watched
+    turn.session["awaiting_video"] = False
+    turn.session["video_watched"] = True
+    return OFFERED_VIDEO
+
+
+def show_video(turn: Turn) -> Sequence[str]:
+    turn.session["awaiting_video"] = False
+    turn.session["last_topic"] = "video"
+    return VIDEO
+
+
+def after_video(turn: Turn) -> Sequence[str]:
+    return AFTER_VIDEO
+
+
+# --- Follow-ups ---
+EXPLAIN_STROKES = StaticReply([
+    "Sure! Let’s go into more detail about the *basic strokes*. 🎶",
+    "The key is to relax your wrist and let the risha (plectrum) glide naturally.",
+    "Start slow, alternate up and down, and keep your rhythm steady — like a heartbeat. ❤️‍🔥",
+    "You can practice on open strings before adding notes or melodies.",
+    "Would you like me to show some *advanced stroke techniques* next?",
+])
+EXPLAIN_TUNING = StaticReply([
+    "Of course! Here’s more about *tuning* your Oud 🎵",
+    "Make sure you tune the bass strings first — C2 and F2 — to anchor the sound.",
+    "Use a tuner app or match to reference sounds I can play for you.",
+    "Would you like to hear the strings again?",
+])
+EXPLAIN_WHICH_PLAY_TOPIC = StaticReply([
+    "Sure! Could you tell me which part you want me to explain more — *tuning* or *strokes*?"
+])
+EXPLAIN_STRUCTURE = StaticReply([
+    "The structure of the Oud is fascinating! 🎶",
+    "The soundboard (front face) is made from spruce or cedar, giving it that resonant tone.",
+    "The bowl is made from walnut or mahogany — each type affects the warmth of the sound.",
+    "Would you like to learn about the materials or string setup next?",
+])
+EXPLAIN_HISTORY = StaticReply([
+    "Historically, the Oud evolved from the Persian barbat and influenced the European lute. 🎵",
+    "It spread through the Islamic Golden Age and became a cornerstone of Arabic music.",
+    "Would you like me to show a timeline image of the Oud’s history?",
+])
+EXPLAIN_WHICH_ABOUT_TOPIC = StaticReply([
+    "Sure! Which topic would you like more details about — *history*, *structure*, or *sound*?"
+])
+EXPLAIN_WHICH_SUBJECT = StaticReply([
+    "I’d love to explain more! Which topic would you like to continue with — the Oud itself or how to play it?"
+])
+CONTINUE_ABOUT = StaticReply([
+    "Let's continue exploring the Oud 🎶 Would you like to learn its History, Structure, Audio or it's image?"
+])
+CONTINUE_PLAYING = StaticReply([
+    "Let's continue learning how to play the Oud 🎵 Would you like to start with *tuning* or *basic strokes*?"
+])
+OFFER_BUY = StaticReply([
+    "Would you like to *buy an Oud*? I can provide you with helpful information before choosing one 🎸"
+])
+OFFER_OUD_LOOKS = StaticReply(["Would you like to see what a *professional* or *beginner* Oud looks like? 🎵"])
+ACK_NOTHING = StaticReply([])
+ACK_ABOUT = StaticReply([
+    "Glad you’re enjoying this! 🎶 Would you like to explore its *history*, *structure*, or *sound* next?"
+])
+ACK_PLAY_WATCHED = StaticReply(["Awesome! 🎵 Would you like to continue with *tuning* or *strokes*?"])
+ACK_PLAY = StaticReply([
+    "Awesome! 🎵 Would you like to continue with *tuning*, *strokes*, or maybe watch a short playing video?"
+])
+ACK_OTHER = StaticReply(["Nice! Would you like to learn more about the Oud or how to play it?"])
+GOODBYE = StaticReply(["Goodbye! Come back anytime to learn more about the Oud 🎵"])
+
+
+def explain_more(turn: Turn) -> Sequence[str]:
+    session = turn.session
+    if session.get("learning_topic") == "play_oud":
+        # Check if last topic was "strokes"
+        if session.get("last_topic") == "strokes":
+            return EXPLAIN_STROKES
+        if session.get("last_topic") == "tuning":
+            return EXPLAIN_TUNING
+        return EXPLAIN_WHICH_PLAY_TOPIC
+    if session.get("learning_topic") == "about_oud":
+        if session.get("last_topic") == "structure":
+            return EXPLAIN_STRUCTURE
+        if session.get("last_topic") == "history":
+            return EXPLAIN_HISTORY
+        return EXPLAIN_WHICH_ABOUT_TOPIC
+    return EXPLAIN_WHICH_SUBJECT
+
+
+def continue_learning(turn: Turn) -> Optional[Sequence[str]]:
+    topic = turn.session.get("learning_topic")
+    if topic == "about_oud":
+        return CONTINUE_ABOUT
+    if topic == "play_oud":
+        return CONTINUE_PLAYING
+    return None
+
+
+def acknowledge(turn: Turn) -> Sequence[str]:
+    session = turn.session
+    # If user just saw Oud picture and we offered to buy
+    if session.get("last_topic") == "oud_picture" or session.get("awaiting_oud_buy_offer"):
+        session["awaiting_oud_buy_offer"] = True
+        return OFFER_BUY
+
+    # If last topic was recommendation
+    if session.get("last_topic") == "recommendation":
+        return OFFER_OUD_LOOKS
+
+    # Fallback to generic acknowledgment
+    topic = session.get("learning_topic")
+    if not topic:
+        return ACK_NOTHING
+    if topic == "about_oud":
+        return ACK_ABOUT
+    if topic == "play_oud":
+        if session.get("video_watched", False):
+            return ACK_PLAY_WATCHED
+        return ACK_PLAY
+    return ACK_OTHER
+
+
+def goodbye(turn: Turn) -> Sequence[str]:
+    return GOODBYE
+
+
+# --- Pending offers ---
+def expire_offers(turn: Turn) -> None:
+    # History and 'understand' turns leave the offer open: the original handler answered them before this reset
+    if turn.intent == "show_oud_history" or turn.lower in UNDERSTAND_PHRASES:
+        return
+    # --- Reset awaiting_picture if topic changed ---
+    if turn.session.get("awaiting_picture") and turn.intent not in ["affirm", "ask_name_origin"]:
+        turn.session["awaiting_picture"] = False
+
+
+# --- States ---
+def _flag(name: str):
+    return lambda session: session.get(name)
+
+
+STATES = {
+    "awaiting_name": _flag("awaiting_name"),
+    "awaiting_song_choice": lambda session: session.get("user_name") and session.get("awaiting_song_choice"),
+    "awaiting_oud_buy_offer": _flag("awaiting_oud_buy_offer"),
+    "awaiting_picture": _flag("awaiting_picture"),
+    "awaiting_professional_oud": _flag("awaiting_professional_oud"),
+    "awaiting_beginner_oud": _flag("awaiting_beginner_oud"),
+    "awaiting_oud_recommendation": _flag("awaiting_oud_recommendation"),
+    "awaiting_video": _flag("awaiting_video"),
+    "awaiting_string_audio": _flag("awaiting_string_audio"),
+    "after_strokes": lambda session: session.get("last_topic") == "strokes",
+    "after_video": lambda session: session.get("last_topic") == "video",
+}
+
+UNDERSTAND_PHRASES = ["understanding the oud", "understanding", "understand"]
+CONTINUE_PHRASES = ["learn", "learn it", "play", "play it", "how to play it"]
+_BEST_RE = re.compile(r"(best|buy|professional|high quality)")
+_BEGINNER_RE = re.compile(r"(beginner|learn|student|easy|beginners)")
+_BEST_OUD_RE = re.compile(r"\b(best oud)\b")
+_BEGINNER_OUD_RE = re.compile(r"\b(most suitable oud|beginner oud|oud for beginners|oud for beginner)\b")
+
+# --- Transition table ---
+# Order matters only between transitions that can fire on the same turn:
+# the earlier one wins.
+TRANSITIONS: List[Transition] = [
+    Transition(None, OPEN, greet_on_open),
+
+    # --- 1. PRIORITY: HANDLE NAME ---
+    Transition("awaiting_name", RAW, capture_name),
+    # --- 2. HANDLE PENDING CHOICES (Like Song Selection) ---
+    Transition("awaiting_song_choice", RAW, pick_song),
+
+    # --- 3. INTENTS (only after name is confirmed) ---
+    Transition(None, "show_oud_history", show_history),
+    Transition(None, ANY, continue_exploring, guard=lambda t: t.lower in UNDERSTAND_PHRASES),
+    Transition(None, "choose_song", list_songs),
+    Transition(None, ANY, famous_song, guard=lambda t: "famous song" in t.lower or "learn song" in t.lower),
+    Transition(None, "show_farid_info", farid_info),
+    Transition(None, "show_oud_picture", show_picture),
+
+    # ✅ User said yes to something we offered
+    Transition("awaiting_oud_buy_offer", "affirm", offer_help_choosing),
+    Transition("awaiting_picture", "affirm", farid_picture),
+    Transition("awaiting_professional_oud", "affirm", show_professional_oud),
+    Transition("awaiting_beginner_oud", "affirm", show_beginner_oud_offer),
+    Transition("awaiting_oud_recommendation", ANY, recommend_best, guard=lambda t: _BEST_RE.search(t.lower)),
+    Transition("awaiting_oud_recommendation", ANY, recommend_beginner, guard=lambda t: _BEGINNER_RE.search(t.lower)),
+
+    # If user types "best oud" or "most suitable oud" later in chat
+    Transition(None, ANY, best_oud, guard=lambda t: _BEST_OUD_RE.search(t.lower)),
+    Transition(None, ANY, most_suitable_oud, guard=lambda t: _BEGINNER_OUD_RE.search(t.lower)),
+
+    Transition("awaiting_video", "affirm_video", play_video_offered),
+    Transition(None, "show_video", show_video),
+    Transition("awaiting_string_audio", "affirm", play_strings),
+    Transition(None, "hear_string_audio", play_strings),
+    Transition("awaiting_string_audio", "deny", skip_strings),
+
+    Transition(None, "ask_name_origin", name_origin),
+    Transition(None, "choose_about_oud", choose_about_oud),
+    Transition(None, "choose_play_oud", choose_play_oud),
+    Transition(None, "ask_tuning_oud", show_tuning),
+    Transition(None, "show_oud_audio", show_audio),
+    Transition(None, "show_oud_structure", show_structure),
+    Transition(None, "ask_strokes_oud", show_strokes),
+    Transition(None, "show_advanced_strokes", show_advanced_strokes),
+    # ✅ If user said "yes" right after basic strokes — show advanced strokes
+    Transition("after_strokes", "affirm", show_advanced_strokes),
+    Transition(None, "explain_more", explain_more),
+    Transition(None, "goodbye", goodbye),
+
+    # --- Continue learning if user says "learn" or "play" alone ---
+    Transition(None, ANY, continue_learning, guard=lambda t: t.lower in CONTINUE_PHRASES),
+    Transition("after_video", ANY, after_video),
+    Transition(None, "acknowledge", acknowledge),
+    Transition(None, "show_beginner_oud", show_beginner_oud),
+    Transition(None, "compare_oud_types", compare_oud_types),
+    # --- When user agrees to buy Oud (yes/ok/sure/etc.) ---
+    Transition("awaiting_oud_buy_offer", "affirm_contain_image", offer_help_choosing_inline),
+]
+
+FLOWS = DialogueEngine(STATES, TRANSITIONS, detect_intent, before_dispatch=expire_offers)
@@ -0,0 +1,186 @@
+import re
+from catalog import ALIAS_INDEX
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# --- Intent table ---
+# Rules are listed in priority order: the first rule that matches (and whose
+# session condition holds) wins. Each rule is one of
+#   "regex"  — re.search anywhere in the message
+#   "exact"  — the whole (lowercased, stripped) message is one of the phrases
+#   "substr" — any phrase occurs as a plain substring
+#   "alias"  — the message mentions one of the listed KEYWORD_DATA_MAP
+#              entities through its aliases (see catalog.ALIAS_INDEX)
+# `sets` is written into the session when the rule wins. `needs` lists
+# literals at least one of which must occur for a regex rule to match; it lets
+# the engine skip the regex with a plain substring test (see _prefilter).
+
+
+class IntentRule(NamedTuple):
+    intent: str
+    kind: str
+    patterns: List[str]
+    when: Optional[Callable[[Dict[str, Any]], bool]] = None
+    sets: Optional[Dict[str, Any]] = None
+    needs: Optional[List[str]] = None
+
+
+AFFIRM_WORDS = ["yes", "sure", "ok", "okay", "yeah"]
+
+INTENT_RULES: List[IntentRule] = [
+    # --- Greetings ---
+    IntentRule("greet", "regex", [r"\b(hello|hi|hey|salam)\b"]),
+    IntentRule("goodbye", "regex", [r"\b(bye|goodbye|see you|good night)\b"]),
+
+    # --- Ask about chatbot name or Farid ---
+    IntentRule("ask_name_origin", "regex", [
+        r"\b("
+        r"why\s+(are|r|did|do|you('| a)?re)\s+(you\s+)?(called|named|have\s+that\s+name)|"
+        r"who\s+(named|is|was)\s+(you|al[\s-]?atrash)|"
+        r"who\s+(do|are)\s+you\s+named\s+after|"
+        r"what\s+does\s+al[\s-]?atrash\s+mean|"
+        r"tell\s+me\s+about\s+(al[\s-]?atrash|farid)|"
+        r"farid\s+al[\s-]?atrash"
+        r")\b"
+    ], needs=["why", "who", "what", "tell", "farid"]),
+    # "the musician", "the oud player": ahead of the play rule, which "player" would match
+    IntentRule("show_farid_info", "alias", ["farid"]),
+
+    # --- Oud topics (looser match) ---
+    IntentRule("choose_about_oud", "regex",
+               [r"(understanding the oud|understanding|understand|understand it|understanding it|understand oud)"],
+               sets={"learning_topic": "about_oud"}),
+    IntentRule("choose_play_oud", "regex", [r"(play|play it|how to play|learn to play)"],
+               sets={"learning_topic": "play_oud"}),
+
+    # --- Subtopics after user picks "about oud" ---
+    IntentRule("show_oud_history", "exact", ["history", "the history", "tell me history", "its history"]),
+    IntentRule("show_oud_structure", "exact", ["structure", "its structure", "about structure", "the structure"]),
+
+    # --- Asking for oud recommendation ---
+    IntentRule("ask_oud_recommendation", "regex", [r"(buy|choose|recommend|select|which).*oud"], needs=["oud"]),
+
+    # --- Subtopics after user picks "how to play" ---
+    IntentRule("ask_tuning_oud", "substr", ["tune", "tuning"]),
+    IntentRule("ask_strokes_oud", "substr", ["stroke", "basic", "practice"]),
+    IntentRule("show_advanced_strokes", "substr", ["advanced stroke", "advanced technique"]),
+
+    # --- Farid follow-up ---
+    IntentRule("show_farid_info", "substr", ["him", "he", "his"],
+               when=lambda s: s.get("last_topic") == "farid"),
+
+    IntentRule("show_oud_picture", "alias", ["oud_picture"]),
+    IntentRule("show_oud_structure", "regex", [
+        r"\b(structure|structure of| the structure | parts|parts of|diagram|diagram of|anatomy|anatomy of).*(oud)\b"
+    ], needs=["oud"]),
+    IntentRule("show_oud_structure", "alias", ["oud_structure"]),
+
+    # --- Audio playback intent ---
+    IntentRule("hear_string_audio", "substr", ["hear sound", "hear the sound of string", "play sound"]),
+    IntentRule("show_oud_audio", "regex", [r"(sound|audio|hear|listen)"]),
+    IntentRule("show_oud_audio", "alias", ["oud_audio"]),
+
+    # --- Video intent ---
+    IntentRule("show_video", "regex",
+               [r"\b(video|watch video|play video|see video|show video|tutorial video|tutorial)\b"]),
+
+    # --- Comparing beginner and professional Oud ---
+    IntentRule("compare_oud_types", "regex", [
+        r"(difference between professional and beginner|difference|difference between them|compare between them|compare|compare between professional and beginner|different between them| different between professional and beginner| different)"
+    ]),
+
+    # --- Affirmation detection with context ---
+    # user likely responding to tuning/audio question
+    IntentRule("affirm", "substr", AFFIRM_WORDS, when=lambda s: bool(s.get("awaiting_string_audio"))),
+    IntentRule("affirm_contain_image", "substr", AFFIRM_WORDS, when=lambda s: bool(s.get("awaiting_oud_buy_offer"))),
+    IntentRule("affirm_video", "substr", ["yes", "sure", "watch", "video"],
+               when=lambda s: bool(s.get("awaiting_video"))),
+
+    # --- Beginner oud (ahead of acknowledgments: "a good oud for beginners") ---
+    IntentRule("show_beginner_oud", "alias", ["oud_beginner"]),
+
+    # --- User acknowledgment (neutral affirmations) ---
+    IntentRule("acknowledge", "substr", ["okay", "ok", "sure", "nice", "great", "thanks", "cool", "good",
+                                         "alright", "amazing", "wonderful", "what else"]),
+    # generic fallback affirm/deny
+    IntentRule("affirm", "substr", AFFIRM_WORDS),
+    IntentRule("deny", "substr", ["no", "not really", "skip", "nope"]),
+
+    # --- User asks for deeper explanation ---
+    IntentRule("explain_more", "substr", ["explain more", "give me more details", "clarify", "more info",
+                                          "tell me more", "more about", "can you elaborate", "go deeper",
+                                          "explain it more", "more details"]),
+    IntentRule("show_beginner_oud", "regex", [r"(beginner|beginners|student)"]),
+    IntentRule("choose_song", "regex", [r"(famous song|learn song|songs|oud songs|music by farid)"]),
+]
+
+DEFAULT_INTENT = "question"
+
+
+# --- Compiled matcher ---
+# Each rule is compiled once into (literals, test):
+#   alias  -> resolved through ALIAS_INDEX, at most once per message
+#   exact  -> no literals, frozenset membership test
+#   substr -> the phrases themselves, no further test
+#   regex  -> literals from `needs` or from a plain "\b(a|b|c)\b" alternation,
+#             then one precompiled search over all of the rule's patterns
+# A plain `in` scan is far cheaper than a regex over the same text, so most
+# rules are rejected without ever entering the regex engine.
+_PLAIN_ALTERNATION = re.compile(r"(\\b)?\(([\w '-]+(?:\|[\w '-]+)*)\)(\\b)?")
+
+
+def _compile_rule(rule: IntentRule) -> Tuple[Optional[Tuple[str, ...]], Optional[Callable[[str], Any]]]:
+    if rule.kind == "alias":
+        return None, None
+    if rule.kind == "exact":
+        return None, frozenset(rule.patterns).__contains__
+    if rule.kind == "substr":
+        return tuple(rule.patterns), None
+    if rule.kind != "regex":
+        raise ValueError(f"unknown intent rule kind: {rule.kind}")
+
+    search = re.compile("|".join(f"(?:{p})" for p in rule.patterns)).search
+    if rule.needs:
+        return tuple(rule.needs), search
+    literals: List[str] = []
+    bounded = False
+    for pattern in rule.patterns:
+        m = _PLAIN_ALTERNATION.fullmatch(pattern)
+        if m is None:
+            return None, search
+        literals.extend(m.group(2).split("|"))
+        bounded = bounded or bool(m.group(1) or m.group(3))
+    # "(a|b|c)" with no word boundaries: the literals are the whole test
+    return tuple(literals), search if bounded else None
+
+
+def compile_rules(rules: List[IntentRule]):
+    return [(rule,) + _compile_rule(rule) for rule in rules]
+
+
+_COMPILED = compile_rules(INTENT_RULES)
+
+
+# --- Intent Detection with Context ---
+def detect_intent(text: str, session: Dict[str, Any]) -> str:
+    txt = text.lower().strip()
+    entities = None
+    for rule, literals, test in _COMPILED:
+        if rule.when is not None and not rule.when(session):
+            continue
+        if rule.kind == "alias":
+            if entities is None:
+                entities = ALIAS_INDEX.entities(txt)
+            if entities.isdisjoint(rule.patterns):
+                continue
+        if literals is not None:
+            for lit in literals:
+                if lit in txt:
+                    break
+            else:
+                continue
+        if test is not None and not test(txt):
+            continue
+        if rule.sets:
+            session.update(rule.sets)  # store context
+        return rule.intent
+    return DEFAULT_INTENT
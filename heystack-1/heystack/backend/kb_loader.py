@@ -0,0 +1,226 @@
+import json
+import os
+from array import array
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+# --- Knowledge-base loader ---
+# Streams paragraphs ("chunks") out of every .txt, .md and .jsonl file under
+# the KB root (backend/data by default), one line at a time, so memory stays
+# bounded by the largest chunk however big the corpus is. Each chunk records
+# the file it came from and its byte range there; the retriever keeps only
+# that metadata (ChunkStore) and reads a chunk's text back when it is used
+# as an answer, after checking that the file still has the size and mtime it
+# had when it was scanned.
+#
+#   .txt   paragraphs separated by blank lines
+#   .md    same, and every heading also starts a new chunk
+#   .jsonl one chunk per record, from its "text" (or "content") field
+
+TEXT_SUFFIXES = (".txt", ".md", ".markdown")
+JSONL_SUFFIXES = (".jsonl",)
+# Long paragraphs are cut at line boundaries past this size (bytes of UTF-8)
+MAX_CHUNK_BYTES = 4096
+
+
+class Chunk(NamedTuple):
+    text: str
+    source: str  # path relative to the KB root
+    offset: int  # byte offset of the chunk in source
+    length: int  # byte length of the chunk in source
+
+
+def kb_files(root: str) -> List[str]:
+    """KB files under root (or root itself, if it is a file), in a stable order."""
+    if os.path.isfile(root):
+        return [root]
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Skip hidden directories and built retrieval indexes (oud_knowledge.index, .tmp, .old)
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".") and ".index" not in d)
+        found.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                     if not name.startswith(".") and name.lower().endswith(TEXT_SUFFIXES + JSONL_SUFFIXES))
+    return found
+
+
+def source_stamp(root: str) -> List[List]:
+    """[relative path, size, mtime_ns] for every KB file: changes whenever a file is added, removed or edited."""
+    stamp = []
+    for path in kb_files(root):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stamp.append([_relative(root, path), st.st_size, st.st_mtime_ns])
+    return stamp
+
+
+def _relative(root: str, path: str) -> str:
+    return os.path.basename(path) if os.path.isfile(root) else os.path.relpath(path, root)
+
+
+def _record_text(line: bytes) -> Optional[str]:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    text = (record.get("text") or record.get("content")) if isinstance(record, dict) else None
+    return text.strip() if isinstance(text, str) and text.strip() else None
+
+
+def _iter_jsonl(path: str, source: str) -> Iterator[Chunk]:
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            text = _record_text(line)
+            if text is not None:
+                yield Chunk(text, source, offset, len(line.rstrip(b"\r\n")))
+            offset += len(line)
+
+
+def _iter_text(path: str, source: str, markdown: bool, max_bytes: int) -> Iterator[Chunk]:
+    start = end = 0  # byte range of the chunk being collected, end == start when empty
+    lines: List[bytes] = []
+    offset = 0
+
+    def flush():
+        text = b"".join(lines).decode("utf-8", errors="replace").strip()
+        return Chunk(text, source, start, end - start) if text else None
+
+    with open(path, "rb") as f:
+        while True:
+            # readline(limit) bounds memory even for a file with no newlines at all
+            line = f.readline(max_bytes)
+            if not line:
+                break
+            if len(line) == max_bytes and not line.endswith(b"\n"):
+                # Cut an overlong line after its last space (or anywhere, if it has none)
+                # so a UTF-8 sequence is not split in two
+                cut = line.rfind(b" ") + 1 or len(line)
+                f.seek(offset + cut)
+                line = line[:cut]
+            blank = not line.strip()
+            boundary = blank or (markdown and line.lstrip().startswith(b"#")) or (end - start + len(line) > max_bytes)
+            if boundary and lines:
+                chunk = flush()
+                if chunk:
+                    yield chunk
+                lines = []
+            if not blank:
+                if not lines:
+                    start = offset
+                lines.append(line)
+                end = offset + len(line.rstrip(b"\r\n"))
+            offset += len(line)
+    if lines:
+        chunk = flush()
+        if chunk:
+            yield chunk
+
+
+def iter_chunks(root: str, max_bytes: int = MAX_CHUNK_BYTES) -> Iterator[Chunk]:
+    for path in kb_files(root):
+        source = _relative(root, path)
+        lower = path.lower()
+        if lower.endswith(JSONL_SUFFIXES):
+            yield from _iter_jsonl(path, source)
+        else:
+            yield from _iter_text(path, source, lower.endswith((".md", ".markdown")), max_bytes)
+
+
+class StaleChunk(OSError):
+    """A chunk's source file was edited, truncated or replaced since the store was built."""
+
+
+class ChunkStore(Sequence[str]):
+    """
+    Chunk texts by position, read back from their source files on access.
+
+    Only the (source, offset, length) of each chunk is held in memory, with
+    the (size, mtime_ns) of every source as scanned. A file deleted since
+    raises FileNotFoundError and one edited since raises StaleChunk (both
+    OSError), rather than returning text from stale offsets, until the
+    knowledge base reloads, which the KB watcher does within its poll interval.
+    """
+
+    def __init__(self, root: str, sources: List[str], source_ids: np.ndarray, offsets: np.ndarray,
+                 lengths: np.ndarray, stamps: Optional[List[Tuple[int, int]]] = None):
+        self.root = root
+        self.sources = sources
+        self.source_ids = source_ids
+        self.offsets = offsets
+        self.lengths = lengths
+        self.stamps = stamps
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def chunk(self, i: int) -> Chunk:
+        i = range(len(self))[i]
+        source = self.sources[self.source_ids[i]]
+        offset, length = int(self.offsets[i]), int(self.lengths[i])
+        path = self.root if os.path.isfile(self.root) else os.path.join(self.root, source)
+        with open(path, "rb") as f:
+            if self.stamps is not None:
+                st = os.fstat(f.fileno())
+                if (st.st_size, st.st_mtime_ns) != self.stamps[self.source_ids[i]]:
+                    raise StaleChunk(f"{source} changed since the knowledge base was loaded")
+            f.seek(offset)
+            raw = f.read(length)
+        if source.lower().endswith(JSONL_SUFFIXES):
+            text = _record_text(raw) or ""
+        else:
+            text = raw.decode("utf-8", errors="replace").strip()
+        return Chunk(text, source, offset, length)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self))[i]]
+        return self.chunk(i).text
+
+
+class ChunkStoreBuilder:
+    """Collects chunk metadata while a caller streams iter_chunks, in compact arrays."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.sources: List[str] = []
+        self.stamps: List[Tuple[int, int]] = []
+        self._source_ids = {}
+        self.ids = array("i")
+        self.offsets = array("q")
+        self.lengths = array("q")
+
+    def add(self, chunk: Chunk) -> None:
+        source_id = self._source_ids.get(chunk.source)
+        if source_id is None:
+            source_id = self._source_ids[chunk.source] = len(self.sources)
+            self.sources.append(chunk.source)
+            self.stamps.append(self._stat(chunk.source))
+        self.ids.append(source_id)
+        self.offsets.append(chunk.offset)
+        self.lengths.append(chunk.length)
+
+    def _stat(self, source: str) -> Tuple[int, int]:
+        try:
+            st = os.stat(self.root if os.path.isfile(self.root) else os.path.join(self.root, source))
+        except OSError:
+            return -1, -1  # gone already: never matches
+        return st.st_size, st.st_mtime_ns
+
+    def build(self) -> ChunkStore:
+        # A file edited while it was being scanned may have chunks from either version: treat it as stale
+        stamps = [stamp if self._stat(source) == stamp else (-1, -1)
+                  for source, stamp in zip(self.sources, self.stamps)]
+        return ChunkStore(self.root, self.sources, np.frombuffer(self.ids, dtype=np.int32),
+                          np.frombuffer(self.offsets, dtype=np.int64), np.frombuffer(self.lengths, dtype=np.int64),
+                          stamps)
+
+
+def scan(root: str, max_bytes: int = MAX_CHUNK_BYTES) -> ChunkStore:
+    """Stream every chunk under root once and keep only their locations."""
+    builder = ChunkStoreBuilder(root)
+    for chunk in iter_chunks(root, max_bytes):
+        builder.add(chunk)
+    return builder.build()
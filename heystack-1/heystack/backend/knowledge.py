@@ -0,0 +1,340 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embeddings import normalise_query
+from kb_loader import ChunkStore, ChunkStoreBuilder, iter_chunks, source_stamp
+from retrieval import analyzer, index_is_current, load_index, make_retriever
+
+if TYPE_CHECKING:
+    from scipy.sparse import csr_matrix
+
+# --- Live knowledge base ---
+# Holds the retriever /chat answers from and swaps in a new one whenever
+# a file under the KB root changes, without restarting the server. Edits are
+# picked up by a polling watcher thread or by POST /admin/reload-kb.
+#
+# A reload streams the KB once (kb_loader.iter_chunks) and keeps only chunk
+# locations and term counts, never the whole text. It is incremental where it
+# counts: every paragraph's term counts are cached under a hash of its text,
+# so only new or edited paragraphs are tokenised again. Term weights depend on the whole collection (idf, BM25
+# length normalisation) and are recomputed from the cached counts, which is
+# a few vectorised numpy passes. The new retriever is published by a single
+# reference assignment, so in-flight lookups finish on the version they
+# started with and are never blocked by a reload.
+#
+# Nothing is loaded when the KnowledgeBase is created: load() (or warm_up(),
+# which runs it on a background thread) maps or fits the retriever, and
+# `ready` is set once the first version is published. Until then the app
+# answers scripted intents as usual and defers knowledge questions.
+
+
+def _paragraph_key(paragraph: str) -> bytes:
+    return hashlib.blake2b(paragraph.encode("utf-8"), digest_size=16).digest()
+
+
+class ResultCache:
+    """
+    Bounded LRU + TTL cache of ranked paragraph ids per (normalised query, top_k).
+
+    Entries are tagged with the KB version they were ranked on and only
+    served for that version, so a lookup that finishes after a reload can
+    never answer from the old paragraphs; publishing a version also drops
+    every entry.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[int, List[int], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, int], version: int) -> Optional[List[int]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != version or now - entry[2] > self.ttl):
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Tuple[str, int], version: int, ids: List[int]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, ids, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "invalidations": self.invalidations,
+        }
+
+
+class KnowledgeBase:
+    """The current retriever over the KB files under kb_root, versioned and reloadable."""
+
+    def __init__(self, kb_root: str, engine: str, index_dir: Optional[str] = None, cache_size: int = 2048,
+                 cache_ttl: float = 3600.0):
+        self.kb_root = kb_root
+        self.engine = engine
+        self.index_dir = index_dir
+        self.version = 0
+        self.retriever = None
+        # (version, retriever) read as one reference, so a lookup never pairs one version's ids with another's text
+        self._current: Tuple[int, Any] = (0, None)
+        # Repeated fallback questions skip vectorising and scoring
+        self.cache = ResultCache(cache_size, cache_ttl)
+        self.source: Optional[str] = None
+        self.ready = threading.Event()
+        self.load_error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.stale_reads = 0
+        self._stamp: Optional[List[List]] = None
+        self.last_reload: Dict[str, Any] = {}
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._analyze = None
+        # Term table; each build compacts it to the terms its paragraphs still use
+        self._term_ids: Dict[str, int] = {}
+        self._terms: List[str] = []
+        # paragraph hash -> (term ids, counts)
+        self._rows: Dict[bytes, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def load(self) -> "KnowledgeBase":
+        """Build the first version: map the prebuilt index if it matches the KB, otherwise fit the KB."""
+        start = time.perf_counter()
+        with self._reload_lock:
+            if self.index_dir and index_is_current(self.index_dir, self.kb_root, self.engine):
+                # Prebuilt by build_index.py: mapped, not fitted. The first reload tokenises everything once.
+                self._stamp = source_stamp(self.kb_root)
+                self.source = "index"
+                self._publish(load_index(self.index_dir))
+        if not self.ready.is_set():
+            self.reload(force=True)
+            self.source = "fit"
+        self.load_seconds = round(time.perf_counter() - start, 3)
+        return self
+
+    def warm_up(self, watch_interval: float = 0.0) -> threading.Thread:
+        """load() on a background thread, then watch(watch_interval); `ready` is set once retrieval works."""
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                # Scripted intents keep working; /ready reports the error and retrieval stays off
+                self.load_error = repr(e)
+                return
+            self.watch(watch_interval)
+
+        thread = threading.Thread(target=run, name="kb-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def _publish(self, retriever) -> None:
+        version = self.version + 1
+        self._current = (version, retriever)
+        self.retriever = retriever
+        self.version = version
+        self.cache.clear()
+        self.ready.set()
+
+    # --- Lookups ---
+    def retrieve(self, query: str, top_k: int = 2) -> List[str]:
+        version, retriever = self._current
+        if retriever is None:
+            return []
+        key = (normalise_query(query), top_k)
+        ids = self.cache.get(key, version)
+        if ids is None:
+            ids = retriever.rank(query, top_k)
+            self.cache.put(key, version, ids)
+        return self._texts(retriever, ids)
+
+    def retrieve_many(self, queries: Sequence[str], top_k: int = 2) -> List[List[str]]:
+        version, retriever = self._current
+        if retriever is None:
+            return [[] for _ in queries]
+        keys = [(normalise_query(query), top_k) for query in queries]
+        ranked = [self.cache.get(key, version) for key in keys]
+        missing = [i for i, ids in enumerate(ranked) if ids is None]
+        if missing:
+            # One batched ranking for every query the cache could not answer
+            for i, ids in zip(missing, retriever.rank_many([queries[i] for i in missing], top_k)):
+                ranked[i] = ids
+                self.cache.put(keys[i], version, ids)
+        return [self._texts(retriever, ids) for ids in ranked]
+
+    def _texts(self, retriever, ids: List[int]) -> List[str]:
+        # Chunks read back from a file deleted or edited since this version was built are left out; the watcher
+        # reloads on its next poll
+        texts = []
+        for i in ids:
+            try:
+                texts.append(retriever.paragraphs[i])
+            except OSError:
+                self.stale_reads += 1
+        return texts
+
+    def _row(self, paragraph: str) -> Tuple[np.ndarray, np.ndarray]:
+        counts = Counter(self._analyze(paragraph))
+        term_ids = []
+        for term in counts:
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                term_id = self._term_ids[term] = len(self._terms)
+                self._terms.append(term)
+            term_ids.append(term_id)
+        return np.array(term_ids, dtype=np.int32), np.fromiter(counts.values(), dtype=np.int32, count=len(counts))
+
+    def _load(self) -> Tuple[Dict[str, Any], ChunkStore, Optional["csr_matrix"], Dict[str, int]]:
+        store = ChunkStoreBuilder(self.kb_root)
+        keys: List[bytes] = []
+        rows: Dict[bytes, Tuple[np.ndarray, np.ndarray]] = {}
+        added = 0
+        for chunk in iter_chunks(self.kb_root):
+            store.add(chunk)
+            key = _paragraph_key(chunk.text)
+            keys.append(key)
+            if key in rows:
+                continue
+            row = self._rows.get(key)
+            if row is None:
+                row = self._row(chunk.text)
+                added += 1
+            rows[key] = row
+        removed = sum(1 for key in self._rows if key not in rows)
+        self._rows = rows
+        changes = {"paragraphs": len(keys), "tokenised": added, "reused": len(rows) - added, "removed": removed}
+        if not keys:
+            self._term_ids, self._terms = {}, []
+            return changes, store.build(), None, {}
+
+        term_ids = np.concatenate([rows[key][0] for key in keys])
+        data = np.concatenate([rows[key][1] for key in keys])
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(rows[key][0]) for key in keys], out=indptr[1:])
+        # Compact the term table to the terms still in use, renumbering the cached rows: a term only in deleted
+        # paragraphs must not count in queries, nor stay in memory across reloads
+        in_use = np.zeros(len(self._terms), dtype=bool)
+        in_use[term_ids] = True
+        if not in_use.all():
+            remap = (np.cumsum(in_use) - 1).astype(np.int32)
+            term_ids = remap[term_ids]
+            self._rows = {key: (remap[ids], row_counts) for key, (ids, row_counts) in rows.items()}
+            self._terms = [self._terms[term_id] for term_id in np.flatnonzero(in_use).tolist()]
+            self._term_ids = {term: term_id for term_id, term in enumerate(self._terms)}
+        from scipy.sparse import csr_matrix
+        counts = csr_matrix((data, term_ids, indptr), shape=(len(keys), len(self._terms)))
+        return changes, store.build(), counts, dict(self._term_ids)
+
+    def reload(self, force: bool = False) -> Dict[str, Any]:
+        """Rebuild from kb_root if any KB file changed (or always, with force) and swap the new retriever in."""
+        with self._reload_lock:
+            stamp = source_stamp(self.kb_root)
+            if stamp == self._stamp and not force:
+                return {"reloaded": False, "version": self.version}
+            start = time.perf_counter()
+            if self._analyze is None:
+                self._analyze = analyzer()
+            changes, paragraphs, counts, vocabulary = self._load()
+            retriever = make_retriever(self.engine, paragraphs, counts, vocabulary)
+            self._stamp = stamp
+            self.source = "reload"
+            self._publish(retriever)
+            self.last_reload = dict(changes, version=self.version, seconds=round(time.perf_counter() - start, 3),
+                                    at=time.time())
+            return dict(self.last_reload, reloaded=True)
+
+    # --- Watching ---
+    def watch(self, interval: float) -> None:
+        """Poll kb_root every `interval` seconds and reload when a KB file is added, removed or edited."""
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="kb-watcher", daemon=True)
+        self._watcher.start()
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            if source_stamp(self.kb_root) != self._stamp:
+                try:
+                    self.reload()
+                except Exception:
+                    # A half-written or unreadable file: keep serving the current version, retry next tick
+                    pass
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "engine": self.engine,
+            "version": self.version,
+            "ready": self.ready.is_set(),
+            "load_seconds": self.load_seconds,
+            "load_error": self.load_error,
+            "paragraphs": len(self.retriever.paragraphs) if self.retriever is not None else 0,
+            "source": self.source,
+            "last_reload": self.last_reload,
+            "stale_reads": self.stale_reads,
+            "result_cache": self.cache.stats(),
+        }
+        if hasattr(self.retriever, "stats"):
+            # Engine counters, e.g. the dense engine's query-embedding cache and batching
+            stats["engine_stats"] = self.retriever.stats()
+        return stats
+
+
+# --- Process pool workers ---
+# With RETRIEVAL_POOL=process every worker opens its own knowledge base once at
+# start-up (mapping the prebuilt index when there is one) and watches the KB
+# files itself, since a reload in the app process cannot reach it.
+_worker_kb: Optional[KnowledgeBase] = None
+
+
+def init_worker(kb_root: str, engine: str, index_dir: str, watch_interval: float = 0.0, cache_size: int = 2048,
+                cache_ttl: float = 3600.0) -> None:
+    global _worker_kb
+    _worker_kb = KnowledgeBase(kb_root, engine, index_dir, cache_size, cache_ttl).load()
+    _worker_kb.watch(watch_interval)
+
+
+def worker_retrieve(query: str, top_k: int = 2) -> List[str]:
+    return _worker_kb.retrieve(query, top_k)
+
+
+def worker_retrieve_many(queries: Sequence[str], top_k: int = 2) -> List[List[str]]:
+    return _worker_kb.retrieve_many(queries, top_k)
@@ -0,0 +1,321 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+from email.utils import formatdate
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, PlainTextResponse, Response
+from starlette.types import Receive, Scope, Send
+
+# --- Static media ---
+# Serves the frontend directory (mounted at /static) for browsers and caches:
+#   - every file also answers under a content-hashed name, C2.wav ->
+#     C2.<hash>.wav; replies link to that name (media_url) and it is served
+#     as immutable for a year, so the tuning WAVs are fetched once per browser
+#     instead of on every hear_string_audio reply. Reply links are rooted at
+#     the mount (/static/...), not relative: the hashed names only exist
+#     behind it, and the page, often opened from file:// or another origin,
+#     resolves them against its API base;
+#   - the plain names (index.html, a bookmarked image) are served no-cache
+#     and revalidate against a strong ETag, the content hash, for a 304;
+#   - HTML is kept in memory with its own src/href links rewritten to the
+#     hashed names, plus gzip and (if the brotli package is installed)
+#     brotli variants chosen by Accept-Encoding;
+#   - other files stream from disk with Range / If-Range support, which
+#     audio seeking relies on.
+# Compact encodings made by build_media.py (Opus/AAC audio, resized WebP)
+# are listed in its manifest; variants() hands them to the reply builders in
+# flows.py, smallest first. Files are hashed once at import. One edited at runtime is rehashed on its
+# next request; replies built before then still link to the old hash, which
+# keeps answering with the current content, but no longer as immutable. The
+# per-request stat, and that rehashing and recompression, run on a worker
+# thread rather than the event loop. Dot-files are never served.
+
+FRONTEND_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend"))
+# Where action.py mounts MEDIA; reply links start with it
+MOUNT_PATH = "/static"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+HTML_SUFFIXES = (".html", ".htm")
+# Text formats worth precompressing; images and audio are compressed already
+COMPRESSIBLE_SUFFIXES = HTML_SUFFIXES + (".css", ".js", ".mjs", ".json", ".svg", ".txt", ".xml")
+PRECOMPRESS_MAX_BYTES = 1 << 20
+HASH_CHARS = 12
+AUDIO_SUFFIXES = (".wav", ".mp3", ".flac", ".ogg", ".oga", ".m4a", ".aac")
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".jfif", ".webp", ".gif")
+VARIANTS_DIR = os.path.join(FRONTEND_DIR, "static", "variants")
+# Written by build_media.py; set to "" to serve the originals only
+MEDIA_MANIFEST = os.environ.get("MEDIA_MANIFEST", os.path.join(VARIANTS_DIR, "manifest.json"))
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/jpeg", ".jfif")
+mimetypes.add_type("audio/ogg", ".opus")
+mimetypes.add_type("audio/mp4", ".m4a")
+
+_LINK = re.compile(r'((?:src|href)=")([^"?#:]+)(")')
+
+
+class MediaFile(NamedTuple):
+    rel: str  # path relative to the media root, "/"-separated
+    digest: str
+    size: int
+    mtime_ns: int
+    media_type: str
+    # In-memory representations by content coding ("identity", "gzip", "br"); empty: stream from disk
+    bodies: Dict[str, bytes]
+
+
+def source_matches(asset: Dict[str, Any], path: str) -> bool:
+    """Whether a manifest entry was built from the file now at path."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return asset.get("size") == st.st_size and asset.get("mtime_ns") == st.st_mtime_ns
+
+
+def load_variants(manifest: str, root: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Source path -> its built variants, smallest first; assets changed since the build are left out."""
+    if not manifest or not os.path.exists(manifest):
+        return {}
+    try:
+        with open(manifest, "r", encoding="utf-8") as f:
+            assets = json.load(f).get("assets", {})
+    except (OSError, ValueError):
+        return {}
+    found = {}
+    for rel, asset in assets.items():
+        variants = asset.get("variants") or []
+        if (variants and source_matches(asset, os.path.join(root, rel))
+                and all(os.path.isfile(os.path.join(root, v["path"])) for v in variants)):
+            found[rel] = sorted(variants, key=lambda v: v["bytes"])
+    return found
+
+
+def _hashed_name(rel: str, digest: str) -> str:
+    stem, ext = posixpath.splitext(rel)
+    return f"{stem}.{digest}{ext}"
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:HASH_CHARS]
+
+
+def _compressed(body: bytes) -> Dict[str, bytes]:
+    variants = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants["br"] = brotli.compress(body, quality=11)
+    return {coding: data for coding, data in variants.items() if len(data) < len(body)}
+
+
+def _accepted(header: str) -> Dict[str, float]:
+    codings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            codings[name.strip().lower()] = q
+    return codings
+
+
+class MediaFiles:
+    """ASGI app serving a directory with hashed URLs, strong ETags, precompressed HTML and byte ranges."""
+
+    def __init__(self, directory: str, manifest: str = "", mount_path: str = MOUNT_PATH):
+        self.directory = os.path.abspath(directory)
+        self.mount_path = mount_path.rstrip("/")
+        self._variants = load_variants(manifest, self.directory)
+        self._files: Dict[str, MediaFile] = {}
+        self._hashed: Dict[str, str] = {}  # hashed name -> rel
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+        self.partial = 0
+        html = []
+        for rel in self._walk():
+            if rel.lower().endswith(HTML_SUFFIXES):
+                html.append(rel)  # after every link target is hashed
+            else:
+                self._add(rel)
+        for rel in html:
+            self._add(rel)
+
+    def _walk(self) -> List[str]:
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            found.extend(os.path.relpath(os.path.join(dirpath, name), self.directory).replace(os.sep, "/")
+                         for name in sorted(filenames) if not name.startswith("."))
+        return found
+
+    def _add(self, rel: str) -> Optional[MediaFile]:
+        path = os.path.join(self.directory, rel)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        lower = rel.lower()
+        bodies: Dict[str, bytes] = {}
+        if lower.endswith(COMPRESSIBLE_SUFFIXES) and st.st_size <= PRECOMPRESS_MAX_BYTES:
+            with open(path, "rb") as f:
+                body = f.read()
+            if lower.endswith(HTML_SUFFIXES):
+                body = self._rewrite_links(rel, body.decode("utf-8", errors="replace")).encode("utf-8")
+            bodies = {"identity": body, **_compressed(body)}
+            digest = hashlib.blake2b(body, digest_size=16).hexdigest()[:HASH_CHARS]
+        else:
+            digest = _file_digest(path)
+        media_type = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+        if media_type.startswith("text/"):
+            media_type += "; charset=utf-8"
+        entry = MediaFile(rel, digest, st.st_size, st.st_mtime_ns, media_type, bodies)
+        with self._lock:
+            self._files[rel] = entry
+            # Old hashed names stay routable (see above)
+            self._hashed[_hashed_name(rel, digest)] = rel
+        return entry
+
+    def _rewrite_links(self, rel: str, html: str) -> str:
+        base = posixpath.dirname(rel)
+
+        def link(m: "re.Match") -> str:
+            target = posixpath.normpath(posixpath.join(base, m.group(2)))
+            entry = self._files.get(target)
+            if entry is None:
+                return m.group(0)
+            return m.group(1) + posixpath.relpath(_hashed_name(target, entry.digest), base or ".") + m.group(3)
+
+        return _LINK.sub(link, html)
+
+    # --- URLs ---
+    def url(self, rel: str) -> str:
+        """URL path of the content-hashed form of a path relative to the media root (plain, if it is unknown)."""
+        entry = self._files.get(rel)
+        return f"{self.mount_path}/{_hashed_name(rel, entry.digest) if entry is not None else rel}"
+
+    def variants(self, rel: str) -> List[Dict[str, Any]]:
+        """Built variants of rel ({"path", "type", "bytes"}, images also "width"), smallest first."""
+        return self._variants.get(rel, [])
+
+    def unversioned(self, text: str) -> str:
+        """text with every media URL and hashed name put back to its plain path relative to the media root."""
+        text = re.sub(r'(^|[\s"\',])' + re.escape(self.mount_path + "/"), r"\1", text)
+        for hashed, rel in self._hashed.items():
+            if hashed in text:
+                text = text.replace(hashed, rel)
+        return text
+
+    # --- Serving ---
+    def _lookup(self, rel: str) -> Tuple[Optional[MediaFile], bool]:
+        """(current entry, whether the requested name is the hash of its current content); blocking."""
+        # Same rule as _walk(): no dot-files or dot-directories, which also rules out "." and ".."
+        if not rel or any(part.startswith(".") for part in rel.split("/")):
+            return None, False
+        rel = posixpath.normpath(rel)
+        plain = self._hashed.get(rel)
+        entry = self._files.get(plain or rel)
+        if entry is None:
+            if plain is not None or not os.path.isfile(os.path.join(self.directory, rel)):
+                return None, False
+            entry = self._add(rel)  # added since start-up
+            return entry, False
+        try:
+            st = os.stat(os.path.join(self.directory, entry.rel))
+        except OSError:
+            return None, False
+        if (st.st_size, st.st_mtime_ns) != (entry.size, entry.mtime_ns):
+            entry = self._add(entry.rel)
+            if entry is None:
+                return None, False
+        return entry, plain is not None and rel == _hashed_name(entry.rel, entry.digest)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request = Request(scope)
+        if request.method not in ("GET", "HEAD"):
+            response: Response = PlainTextResponse("Method Not Allowed", status_code=405,
+                                                   headers={"Allow": "GET, HEAD"})
+        else:
+            entry, immutable = await run_in_threadpool(self._lookup, self._requested(request))
+            response = self.respond(request, entry, immutable)
+        await response(scope, receive, send)
+
+    @staticmethod
+    def _requested(request: Request) -> str:
+        root_path = request.scope.get("root_path", "")
+        path = request.scope["path"]
+        return (path[len(root_path):] if root_path and path.startswith(root_path) else path).lstrip("/")
+
+    def respond(self, request: Request, entry: Optional[MediaFile], immutable: bool) -> Response:
+        if entry is None:
+            return PlainTextResponse("Not Found", status_code=404)
+        self.requests += 1
+
+        coding = "identity"
+        if len(entry.bodies) > 1:
+            accepted = _accepted(request.headers.get("accept-encoding", ""))
+            for candidate in ("br", "gzip"):
+                if candidate in entry.bodies and accepted.get(candidate, 0) > 0:
+                    coding = candidate
+                    break
+        # Each representation gets its own strong validator
+        etag = f'"{entry.digest}"' if coding == "identity" else f'"{entry.digest}-{coding}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE if immutable else REVALIDATE,
+            "Last-Modified": formatdate(entry.mtime_ns / 1e9, usegmt=True),
+        }
+        if len(entry.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in
+                              [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        if entry.bodies:
+            body = entry.bodies[coding]
+            if coding != "identity":
+                headers["Content-Encoding"] = coding
+            headers["Content-Length"] = str(len(body))
+            return Response(b"" if request.method == "HEAD" else body, media_type=entry.media_type, headers=headers)
+
+        if "range" in request.headers:
+            self.partial += 1
+        # FileResponse answers Range (206, multipart/byteranges, 416) and If-Range against the ETag given here
+        return FileResponse(os.path.join(self.directory, entry.rel), media_type=entry.media_type, headers=headers)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "files": len(self._files),
+            "with_variants": len(self._variants),
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "range_requests": self.partial,
+        }
+
+
+MEDIA = MediaFiles(FRONTEND_DIR, MEDIA_MANIFEST)
+media_url = MEDIA.url
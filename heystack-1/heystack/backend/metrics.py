@@ -0,0 +1,163 @@
+import os
+import sys
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# --- Metrics ---
+# A minimal Prometheus registry for GET /metrics (text exposition format
+# 0.0.4). Instruments are only touched from the event loop, so recording one
+# is a dict lookup, a bisect and a few additions, with no lock: cheap enough
+# to leave on for every turn. Gauges (and counters kept elsewhere, such as
+# a store's bytes_written) are callbacks read when /metrics is scraped.
+# Each server process keeps its own numbers.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds: 25µs (intent detection) up to 5s (retrieval under load)
+LATENCY_BUCKETS = (0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+Number = Union[int, float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: Number) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def resident_memory_bytes() -> int:
+    """Current RSS on Linux; elsewhere the peak RSS, which is what getrusage offers."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+class _Series:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot: above the largest bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram:
+    """Latency histogram with one series per combination of label values."""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _Series] = {}
+
+    def labels(self, *values: str) -> _Series:
+        series = self._series.get(values)
+        if series is None:
+            series = self._series[values] = _Series(self.buckets)
+        return series
+
+    def observe(self, value: float, *label_values: str) -> None:
+        self.labels(*label_values).observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {_number(series.sum)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {series.count}")
+        return lines
+
+
+class Counter:
+    """Monotonic count per combination of label values."""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], Number] = {}
+
+    def inc(self, *label_values: str, amount: Number = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> Number:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_labels(self.label_names, values)} {_number(count)}"
+                     for values, count in sorted(self._values.items()))
+        return lines
+
+
+class Callback:
+    """A gauge (or a counter kept by another object) read from fn() at scrape time."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Number], kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return []  # a source that cannot answer right now (store closing, ...) is left out of this scrape
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {_number(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Union[Histogram, Counter, Callback]] = []
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str] = (),
+                  buckets: Optional[Sequence[float]] = None) -> Histogram:
+        metric = Histogram(name, help, label_names, buckets or LATENCY_BUCKETS)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Number]) -> Callback:
+        metric = Callback(name, help, fn)
+        self._metrics.append(metric)
+        return metric
+
+    def counter_func(self, name: str, help: str, fn: Callable[[], Number]) -> Callback:
+        metric = Callback(name, help, fn, kind="counter")
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        lines = [line for metric in self._metrics for line in metric.render()]
+        return ("\n".join(lines) + "\n").encode("utf-8")
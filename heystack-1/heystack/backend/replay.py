@@ -0,0 +1,82 @@
+"""
+Replay recorded conversations against the dialogue engine.
+
+    python backend/replay.py transcripts/*.json
+    python backend/replay.py --record transcripts/my_flow.json
+
+Each transcript is {"now": ISO time, "turns": [{"user": ..., "bot": [...]}]}.
+"bot": null means no flow handled the turn and /chat would fall back to
+knowledge-base retrieval. --record rewrites every "bot" entry from the
+current flows, for authoring new transcripts. Media links are compared by
+their plain path (static/audio/C2.wav), not the content-hashed one the
+replies carry, and media variants are turned off (MEDIA_MANIFEST=""), so
+re-encoding an asset does not invalidate transcripts.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+# Transcripts hold the tags for the original media files, whatever variants build_media.py made locally
+os.environ.setdefault("MEDIA_MANIFEST", "")
+
+from dialogue import Turn  # noqa: E402
+from flows import FLOWS, new_session  # noqa: E402
+from media import MEDIA  # noqa: E402
+
+
+def replay(transcript, record=False):
+    now = datetime.fromisoformat(transcript.get("now", "2024-01-01T10:00:00"))
+    session = new_session()
+    failures = []
+    elapsed = 0.0
+    for i, step in enumerate(transcript["turns"]):
+        turn = Turn("replay", step["user"].strip(), session, now=now)
+        start = time.perf_counter()
+        responses = FLOWS.run(turn)
+        elapsed += time.perf_counter() - start
+        if responses is not None:
+            responses = [MEDIA.unversioned(line) for line in responses]
+        if record:
+            step["bot"] = responses
+        elif responses != step["bot"]:
+            failures.append((i, step["user"], step["bot"], responses))
+    return failures, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay chat transcripts against the dialogue flows.")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--record", action="store_true", help="rewrite expected replies from the current flows")
+    args = parser.parse_args()
+
+    failed = 0
+    turns = 0
+    elapsed = 0.0
+    for path in args.paths:
+        with open(path, "r", encoding="utf-8") as f:
+            transcript = json.load(f)
+        failures, spent = replay(transcript, record=args.record)
+        turns += len(transcript["turns"])
+        elapsed += spent
+
+        if args.record:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(transcript, f, indent=2, ensure_ascii=False)
+                f.write("\n")
+            print(f"recorded {path}")
+            continue
+        for i, user, expected, actual in failures:
+            print(f"FAIL {path} turn {i} {user!r}\n  expected: {expected}\n  actual:   {actual}")
+        print(f"{'ok  ' if not failures else 'FAIL'} {path}")
+        failed += bool(failures)
+
+    if turns:
+        print(f"{turns} turns, {elapsed / turns * 1e6:.1f} us/turn dispatch")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import json
+from typing import List, Sequence
+
+# --- Pre-serialised replies ---
+# Most replies never change between users. They are built once at import as
+# StaticReply, which also carries its JSON array already encoded, so a turn
+# answered from the catalogue only has to encode the recipient.
+#
+# Streamed turns (/chat/stream, /chat/ws) send one JSON object per response,
+#   {"type":"message","index":0,"text":"..."}
+# and finish with {"type":"done","recipient":"...","count":N}. Static
+# replies carry those message frames pre-encoded as well.
+
+
+def encode_json(value) -> bytes:
+    # Same output as fastapi's JSONResponse
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _message_frame(index: int, text: str) -> bytes:
+    return b'{"type":"message","index":' + str(index).encode() + b',"text":' + encode_json(text) + b"}"
+
+
+class StaticReply(tuple):
+    """Immutable list of responses with its JSON encoding computed once."""
+
+    def __new__(cls, lines: Sequence[str]):
+        reply = super().__new__(cls, lines)
+        reply.payload = encode_json(list(reply))
+        reply.frames = tuple(_message_frame(i, line) for i, line in enumerate(reply))
+        return reply
+
+
+def render_payload(recipient: str, responses: Sequence[str]) -> bytes:
+    body = responses.payload if isinstance(responses, StaticReply) else encode_json(list(responses))
+    return b'{"recipient":' + encode_json(recipient) + b',"responses":' + body + b"}"
+
+
+def render_frames(responses: Sequence[str]) -> List[bytes]:
+    if isinstance(responses, StaticReply):
+        return list(responses.frames)
+    return [_message_frame(i, line) for i, line in enumerate(responses)]
+
+
+def render_done(recipient: str, count: int) -> bytes:
+    return b'{"type":"done","recipient":' + encode_json(recipient) + b',"count":' + str(count).encode() + b"}"
@@ -0,0 +1,402 @@
+import json
+import os
+import shutil
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embeddings import DEFAULT_MODEL, query_embedder
+from kb_loader import source_stamp
+
+if TYPE_CHECKING:
+    from scipy.sparse import csr_matrix
+
+# --- Knowledge base retrieval ---
+# Answers questions no flow handled with the closest paragraphs of the
+# knowledge base (see kb_loader). Lives outside action.py so that pool worker
+# processes can build their own retriever without importing the app.
+#
+# Simple retrieval with scikit-learn's tokeniser. sklearn and scipy are
+# imported inside the functions that use them: they are most of the app's
+# import time, and the server starts answering scripted intents before the
+# retriever is built (see KnowledgeBase.warm_up).
+
+MIN_SCORE = 0.05
+
+
+def analyzer():
+    """Tokeniser shared by every engine and by incremental ingestion (lowercase words, English stop words dropped)."""
+    from sklearn.feature_extraction.text import CountVectorizer
+    return CountVectorizer(stop_words="english").build_analyzer()
+
+
+def count_terms(paragraphs: Sequence[str]) -> Tuple[Optional["csr_matrix"], Dict[str, int]]:
+    """Paragraph x term count matrix and its vocabulary; (None, {}) for an empty KB."""
+    if not paragraphs:
+        return None, {}
+    from sklearn.feature_extraction.text import CountVectorizer
+    counter = CountVectorizer(stop_words="english")
+    return counter.fit_transform(paragraphs).tocsr(), counter.vocabulary_
+
+
+def top_k_positions(scores: np.ndarray, doc_ids: np.ndarray, top_k: int) -> np.ndarray:
+    """Positions of the top_k highest scores, best first; ties go to the earlier paragraph."""
+    positions = np.arange(len(scores))
+    if len(scores) > top_k:
+        # O(n) selection of the k best, only those k are sorted
+        positions = np.argpartition(-scores, top_k - 1)[:top_k]
+    return positions[np.lexsort((doc_ids[positions], -scores[positions]))]
+
+
+class TfidfRetriever:
+    """TF-IDF over the knowledge-base paragraphs, ranked by cosine similarity."""
+
+    def __init__(self, paragraphs: Sequence[str], counts: Optional["csr_matrix"] = None,
+                 vocabulary: Optional[Dict[str, int]] = None):
+        """Fit on `paragraphs`; precomputed counts/vocabulary (see count_terms) skip tokenising them."""
+        self.paragraphs = paragraphs
+        self.params: Dict[str, Any] = {}
+        self.analyze = analyzer()
+        if counts is None:
+            counts, vocabulary = count_terms(paragraphs)
+        self.vocabulary: Dict[str, int] = vocabulary
+        self.idf = np.empty(0)
+        self.term_docs = None
+        if counts is None:
+            return
+
+        # Same weighting as TfidfVectorizer: raw tf x smoothed idf, rows L2-normalised
+        from scipy.sparse import csr_matrix
+        from sklearn.preprocessing import normalize
+        n = counts.shape[0]
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        self.idf = np.log((1 + n) / (1 + df)) + 1
+        tfidf = normalize(csr_matrix(counts.multiply(self.idf)))
+        # Term-major copy of the matrix: row t lists the paragraphs containing term t,
+        # so a query only touches the postings of its own terms
+        self.term_docs = tfidf.T.tocsr()
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"idf": self.idf, "indptr": self.term_docs.indptr,
+                "indices": self.term_docs.indices, "data": self.term_docs.data}
+
+    @classmethod
+    def from_arrays(cls, paragraphs: Sequence[str], vocabulary: Dict[str, int],
+                    arrays: Dict[str, np.ndarray], params: Dict[str, Any]) -> "TfidfRetriever":
+        retriever = cls.__new__(cls)
+        retriever.paragraphs = paragraphs
+        retriever.vocabulary = vocabulary
+        retriever.idf = arrays["idf"]
+        from scipy.sparse import csr_matrix
+        # copy=False keeps the (memory-mapped) arrays as the matrix storage
+        retriever.term_docs = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                                         shape=(len(vocabulary), len(paragraphs)), copy=False)
+        retriever.analyze = analyzer()
+        return retriever
+
+    def query_matrix(self, queries: Sequence[str]) -> "csr_matrix":
+        """
+        Same rows as TfidfVectorizer.transform(queries) (raw tf x idf, L2 norm),
+        without sklearn's per-call validation overhead, which dominates for
+        one short query.
+        """
+        vocabulary, idf = self.vocabulary, self.idf
+        indptr, indices, data = [0], [], []
+        for query in queries:
+            counts = Counter(term_id for term_id in map(vocabulary.get, self.analyze(query)) if term_id is not None)
+            term_ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts)) * idf[term_ids]
+            norm = np.sqrt(weights @ weights)
+            indices.append(term_ids)
+            data.append(weights / norm if norm else weights)
+            indptr.append(indptr[-1] + len(counts))
+        from scipy.sparse import csr_matrix
+        return csr_matrix((np.concatenate(data), np.concatenate(indices), indptr),
+                          shape=(len(queries), len(idf)))
+
+    def rank(self, query: str, top_k: int = 2) -> List[int]:
+        return self.rank_many([query], top_k)[0]
+
+    def rank_many(self, queries: Sequence[str], top_k: int = 2) -> List[List[int]]:
+        """Ids of the best paragraphs for each query, best first."""
+        if self.term_docs is None or not queries:
+            return [[] for _ in queries]
+        # Rows of both matrices are L2-normalised, so the dot product is the cosine similarity.
+        # The product stays sparse: only paragraphs sharing a term with the query get a score.
+        sims = (self.query_matrix(queries) @ self.term_docs).tocsr()
+        ranked = []
+        for row in range(sims.shape[0]):
+            lo, hi = sims.indptr[row], sims.indptr[row + 1]
+            scores, doc_ids = sims.data[lo:hi], sims.indices[lo:hi]
+            ranked.append([int(doc_ids[j]) for j in top_k_positions(scores, doc_ids, top_k) if scores[j] > MIN_SCORE])
+        return ranked
+
+    def retrieve(self, query: str, top_k: int = 2) -> List[str]:
+        return [self.paragraphs[i] for i in self.rank(query, top_k)]
+
+    def retrieve_many(self, queries: Sequence[str], top_k: int = 2) -> List[List[str]]:
+        return [[self.paragraphs[i] for i in ids] for ids in self.rank_many(queries, top_k)]
+
+
+class BM25Retriever:
+    """
+    Okapi BM25 over an inverted index.
+
+    Postings are stored flat, term by term: the postings of term t are
+    doc_ids[offsets[t]:offsets[t + 1]], with the matching BM25 contribution
+    of t to each of those paragraphs precomputed in impacts. A query only
+    reads the postings of its own terms and never touches other paragraphs.
+
+    Raw BM25 scores are unbounded, so the MIN_SCORE cut-off is applied to
+    the score divided by the best score the query could reach, which puts
+    it on the same 0-1 scale as the TF-IDF cosine.
+    """
+
+    def __init__(self, paragraphs: Sequence[str], counts: Optional["csr_matrix"] = None,
+                 vocabulary: Optional[Dict[str, int]] = None, k1: float = 1.5, b: float = 0.75):
+        self.paragraphs = paragraphs
+        self.k1 = k1
+        self.params = {"k1": k1, "b": b}
+        self.analyze = analyzer()
+        if counts is None:
+            counts, vocabulary = count_terms(paragraphs)
+        self.vocabulary: Dict[str, int] = vocabulary
+        if counts is None:
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.doc_ids = np.empty(0, dtype=np.int32)
+            self.idf = self.impacts = np.empty(0)
+            return
+
+        # Column-major term counts are exactly the postings lists, in doc_id order
+        postings = counts.tocsc()
+        self.offsets = postings.indptr.astype(np.int64)
+        self.doc_ids = postings.indices.astype(np.int32)
+        tf = postings.data.astype(np.float64)
+
+        n = len(paragraphs)
+        df = np.diff(self.offsets)
+        lengths = np.asarray(counts.sum(axis=1), dtype=np.float64).ravel()
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        norm = k1 * (1 - b + b * lengths[self.doc_ids] / lengths.mean())
+        self.impacts = np.repeat(self.idf, df) * tf * (k1 + 1) / (tf + norm)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"offsets": self.offsets, "doc_ids": self.doc_ids, "idf": self.idf, "impacts": self.impacts}
+
+    @classmethod
+    def from_arrays(cls, paragraphs: Sequence[str], vocabulary: Dict[str, int],
+                    arrays: Dict[str, np.ndarray], params: Dict[str, Any]) -> "BM25Retriever":
+        retriever = cls.__new__(cls)
+        retriever.paragraphs = paragraphs
+        retriever.k1 = params["k1"]
+        retriever.analyze = analyzer()
+        retriever.vocabulary = vocabulary
+        for name, array in arrays.items():
+            setattr(retriever, name, array)
+        return retriever
+
+    def score(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(scores, doc_ids) for every paragraph sharing a term with `query`, scores scaled to 0-1."""
+        term_ids = [t for t in map(self.vocabulary.get, self.analyze(query)) if t is not None]
+        if not term_ids:
+            return np.empty(0), np.empty(0, dtype=np.int32)
+        slices = [slice(self.offsets[t], self.offsets[t + 1]) for t in term_ids]
+        hits = np.concatenate([self.doc_ids[s] for s in slices])
+        doc_ids, slot = np.unique(hits, return_inverse=True)
+        scores = np.bincount(slot, weights=np.concatenate([self.impacts[s] for s in slices]))
+        # A term's impact is below idf * (k1 + 1) however often it occurs in a paragraph
+        return scores / (self.idf[term_ids].sum() * (self.k1 + 1)), doc_ids
+
+    def rank(self, query: str, top_k: int = 2) -> List[int]:
+        """Ids of the best paragraphs for `query`, best first."""
+        scores, doc_ids = self.score(query)
+        return [int(doc_ids[j]) for j in top_k_positions(scores, doc_ids, top_k) if scores[j] > MIN_SCORE]
+
+    def rank_many(self, queries: Sequence[str], top_k: int = 2) -> List[List[int]]:
+        return [self.rank(query, top_k) for query in queries]
+
+    def retrieve(self, query: str, top_k: int = 2) -> List[str]:
+        return [self.paragraphs[i] for i in self.rank(query, top_k)]
+
+    def retrieve_many(self, queries: Sequence[str], top_k: int = 2) -> List[List[str]]:
+        return [[self.paragraphs[i] for i in ids] for ids in self.rank_many(queries, top_k)]
+
+
+class DenseRetriever:
+    """
+    Cosine similarity between sentence embeddings (needs sentence-transformers, see embeddings.py).
+
+    Paragraph embeddings are the L2-normalised float32 rows of one matrix,
+    which build_index.py writes to the index so workers memory-map it
+    instead of running the model over the whole KB. A query costs one
+    embedding (batched with concurrent queries, or a cache hit) and one
+    matrix-vector product. Cosines between unrelated sentences are well
+    above zero, hence a higher cut-off than MIN_SCORE.
+    """
+
+    def __init__(self, paragraphs: Sequence[str], counts: Optional["csr_matrix"] = None,
+                 vocabulary: Optional[Dict[str, int]] = None, model: str = DEFAULT_MODEL, min_score: float = 0.3):
+        # counts/vocabulary are accepted for make_retriever's signature; embeddings need the raw text
+        self.paragraphs = paragraphs
+        self.vocabulary: Dict[str, int] = {}
+        self.params = {"model": model, "min_score": min_score}
+        self.min_score = min_score
+        self.embedder = query_embedder(model)
+        self.embeddings = self.embedder.embed_paragraphs(paragraphs)
+        self.doc_ids = np.arange(len(paragraphs), dtype=np.int32)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"embeddings": self.embeddings}
+
+    @classmethod
+    def from_arrays(cls, paragraphs: Sequence[str], vocabulary: Dict[str, int],
+                    arrays: Dict[str, np.ndarray], params: Dict[str, Any]) -> "DenseRetriever":
+        retriever = cls.__new__(cls)
+        retriever.paragraphs = paragraphs
+        retriever.vocabulary = vocabulary
+        retriever.params = params
+        retriever.min_score = params["min_score"]
+        retriever.embedder = query_embedder(params["model"])
+        retriever.embeddings = arrays["embeddings"]
+        retriever.doc_ids = np.arange(len(paragraphs), dtype=np.int32)
+        return retriever
+
+    def _top(self, scores: np.ndarray, top_k: int) -> List[int]:
+        return [int(j) for j in top_k_positions(scores, self.doc_ids, top_k) if scores[j] > self.min_score]
+
+    def rank(self, query: str, top_k: int = 2) -> List[int]:
+        """Ids of the best paragraphs for `query`, best first."""
+        if not len(self.paragraphs) or not query.strip():
+            return []
+        return self._top(self.embeddings @ self.embedder.embed(query), top_k)
+
+    def rank_many(self, queries: Sequence[str], top_k: int = 2) -> List[List[int]]:
+        if not len(self.paragraphs) or not queries:
+            return [[] for _ in queries]
+        scores = self.embeddings @ self.embedder.embed_many(queries).T
+        return [self._top(scores[:, i], top_k) if query.strip() else [] for i, query in enumerate(queries)]
+
+    def retrieve(self, query: str, top_k: int = 2) -> List[str]:
+        return [self.paragraphs[i] for i in self.rank(query, top_k)]
+
+    def retrieve_many(self, queries: Sequence[str], top_k: int = 2) -> List[List[str]]:
+        return [[self.paragraphs[i] for i in ids] for ids in self.rank_many(queries, top_k)]
+
+    def stats(self) -> Dict[str, Any]:
+        return self.embedder.stats()
+
+
+# RETRIEVAL_ENGINE values
+ENGINES = {
+    "tfidf": TfidfRetriever,
+    "bm25": BM25Retriever,
+    "dense": DenseRetriever,
+}
+
+
+def make_retriever(engine: str, paragraphs: Sequence[str], counts: Optional["csr_matrix"] = None,
+                   vocabulary: Optional[Dict[str, int]] = None):
+    if engine not in ENGINES:
+        raise ValueError(f"unknown retrieval engine: {engine} (expected one of {', '.join(ENGINES)})")
+    return ENGINES[engine](paragraphs, counts, vocabulary)
+
+
+# --- Persisted index ---
+# `python backend/build_index.py` fits the retriever offline and writes it to
+# a directory next to the knowledge base:
+#
+#   meta.json               engine, its parameters, and the size/mtime of the KB files it was built from
+#   vocabulary.json         terms in term-id order
+#   paragraphs.npy          every paragraph, UTF-8, back to back
+#   paragraph_offsets.npy   byte offset of each paragraph (plus the end)
+#   <array>.npy             the engine's arrays (CSR matrix / postings, idf, embeddings, ...)
+#
+# Arrays are opened with mmap_mode="r", so loading costs the same whatever
+# the KB size and every worker process shares the same page-cache pages.
+
+INDEX_FORMAT = 1
+
+
+class MappedParagraphs(Sequence[str]):
+    """Paragraphs decoded on access from the memory-mapped index."""
+
+    def __init__(self, text: np.ndarray, offsets: np.ndarray):
+        self.text = text
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self))[i]]
+        i = range(len(self))[i]
+        return self.text[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+
+def save_index(retriever, engine: str, index_dir: str, kb_root: str) -> None:
+    """Write `retriever` to `index_dir`, replacing any previous index only once the new one is complete."""
+    tmp_dir = index_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # Two streaming passes over the paragraphs (sizes, then bytes) so the KB is never held in memory
+    paragraphs = retriever.paragraphs
+    offsets = np.zeros(len(paragraphs) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(p.encode("utf-8")) for p in paragraphs), dtype=np.int64, count=len(paragraphs)),
+              out=offsets[1:])
+    text = np.lib.format.open_memmap(os.path.join(tmp_dir, "paragraphs.npy"), mode="w+", dtype=np.uint8,
+                                     shape=(int(offsets[-1]),))
+    for i, paragraph in enumerate(paragraphs):
+        text[offsets[i]:offsets[i + 1]] = np.frombuffer(paragraph.encode("utf-8"), dtype=np.uint8)
+    text.flush()
+    del text
+    np.save(os.path.join(tmp_dir, "paragraph_offsets.npy"), offsets)
+    for name, array in retriever.arrays().items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    with open(os.path.join(tmp_dir, "vocabulary.json"), "w", encoding="utf-8") as f:
+        json.dump(sorted(retriever.vocabulary, key=retriever.vocabulary.get), f, ensure_ascii=False)
+    # meta.json last: a directory without it is never taken for an index
+    meta = {"format": INDEX_FORMAT, "engine": engine, "params": retriever.params,
+            "source": source_stamp(kb_root), "paragraphs": len(paragraphs), "arrays": sorted(retriever.arrays())}
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    old_dir = index_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(index_dir):
+        os.rename(index_dir, old_dir)
+    os.rename(tmp_dir, index_dir)
+    # Processes that still map the old files keep them alive until they close them
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def read_index_meta(index_dir: str):
+    try:
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_index(index_dir: str):
+    meta = read_index_meta(index_dir)
+    if meta is None or meta.get("format") != INDEX_FORMAT:
+        raise ValueError(f"no usable retrieval index in {index_dir}")
+
+    def mapped(name: str) -> np.ndarray:
+        return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+
+    with open(os.path.join(index_dir, "vocabulary.json"), "r", encoding="utf-8") as f:
+        vocabulary = {term: term_id for term_id, term in enumerate(json.load(f))}
+    paragraphs = MappedParagraphs(mapped("paragraphs"), mapped("paragraph_offsets"))
+    arrays = {name: mapped(name) for name in meta["arrays"]}
+    return ENGINES[meta["engine"]].from_arrays(paragraphs, vocabulary, arrays, meta["params"])
+
+
+def index_is_current(index_dir: str, kb_root: str, engine: str) -> bool:
+    """True when index_dir holds an index for `engine` built from the KB files under kb_root as they are now."""
+    meta = read_index_meta(index_dir)
+    return (meta is not None and meta.get("format") == INDEX_FORMAT and meta.get("engine") == engine
+            and meta.get("source") == source_stamp(kb_root))
@@ -0,0 +1,155 @@
+import asyncio
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# --- Retrieval worker pool ---
+# Knowledge-base retrieval is CPU-bound (sklearn transform + similarity), so
+# running it inside the async /chat handler stalls every other connection on
+# the event loop. The pool runs it on worker threads or processes instead and
+# caps how many lookups may be in flight; once the cap is reached new lookups
+# are refused straight away rather than queueing behind a backlog.
+
+
+class PoolBusy(Exception):
+    """Raised when the pool already has max_pending lookups in flight."""
+
+
+def _timed(fn: Callable[..., Any], args: Tuple[Any, ...]) -> Tuple[Any, float]:
+    # Runs in the worker; its own run time lets the caller split latency into queue wait and work
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def _noop() -> None:
+    pass
+
+
+def _percentile(samples: Deque[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class RetrievalPool:
+    """
+    Bounded executor for blocking lookups.
+
+    kind is "thread" or "process". max_pending bounds queued + running
+    lookups; timeout (seconds) bounds how long a caller waits for its result.
+    Both surface as PoolBusy / asyncio.TimeoutError so the caller can answer
+    the turn without a retrieval result.
+    """
+
+    def __init__(self, fn: Callable[..., Any], kind: str = "thread", workers: int = 4, max_pending: int = 64,
+                 timeout: Optional[float] = None, initializer: Optional[Callable[..., None]] = None,
+                 initargs: Tuple[Any, ...] = (), window: int = 1024):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"unknown retrieval pool kind: {kind}")
+        self.fn = fn
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor: Executor
+        self._warm_up: List[Future] = []
+        if kind == "process":
+            # spawn: the app process already runs threads (session writer), which fork does not copy safely
+            self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=initializer, initargs=initargs)
+            # Start the workers (and run their initializer) now rather than on the first fallback question.
+            # A spawned child re-imports __main__, so never start a pool from inside another pool's worker.
+            if multiprocessing.parent_process() is None:
+                self._warm_up = [self._executor.submit(_noop) for _ in range(workers)]
+        else:
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix="retrieval",
+                                                initializer=initializer, initargs=initargs)
+
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.errors = 0
+        # Recent samples only, in seconds
+        self._wait: Deque[float] = deque(maxlen=window)
+        self._run: Deque[float] = deque(maxlen=window)
+        self._total: Deque[float] = deque(maxlen=window)
+
+    async def run(self, *args: Any) -> Any:
+        return await self.call(self.fn, *args)
+
+    async def call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Like run(), with another function (picklable, for a process pool); shares the same limits and stats."""
+        # in_flight is only touched from the event loop, so no lock is needed
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise PoolBusy(f"{self.in_flight} retrieval lookups already in flight")
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.submitted += 1
+        start = time.perf_counter()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, _timed, fn, args)
+            # shield: a caller that gives up must not cancel the lookup, in_flight is released when it ends
+            result, ran = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            future.add_done_callback(self._release)
+            raise
+        except asyncio.CancelledError:
+            # The caller went away (client disconnect, ...): the lookup still holds its slot until it finishes
+            self.cancelled += 1
+            future.add_done_callback(self._release)
+            raise
+        except Exception:
+            self.errors += 1
+            self.in_flight -= 1
+            raise
+        self.in_flight -= 1
+        self.completed += 1
+        total = time.perf_counter() - start
+        self._total.append(total)
+        self._run.append(ran)
+        self._wait.append(max(0.0, total - ran))
+        return result
+
+    def _release(self, _future) -> None:
+        self.in_flight -= 1
+
+    @property
+    def ready(self) -> bool:
+        """False while no process worker has finished its initializer (thread pools are always ready)."""
+        return not self._warm_up or any(f.done() and not f.cancelled() and f.exception() is None for f in self._warm_up)
+
+    def stats(self) -> Dict[str, Any]:
+        def ms(samples: Deque[float], q: float) -> float:
+            return round(_percentile(samples, q) * 1000, 3)
+
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "ready": self.ready,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.workers),
+            "max_in_flight": self.max_in_flight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+            "queue_wait_ms": {"p50": ms(self._wait, 0.5), "p99": ms(self._wait, 0.99)},
+            "run_ms": {"p50": ms(self._run, 0.5), "p99": ms(self._run, 0.99)},
+            "latency_ms": {"p50": ms(self._total, 0.5), "p99": ms(self._total, 0.99)},
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
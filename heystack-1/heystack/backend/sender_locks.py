@@ -0,0 +1,57 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+
+# --- Per-sender turn ordering ---
+# A turn reads the sender's session, may await retrieval, then writes the
+# session back. Two turns of the same sender interleaving across that await
+# would each start from the same state and the second write would drop the
+# first turn's changes (awaiting_song_choice, awaiting_string_audio, ...).
+# /chat therefore holds the sender's lock for the whole turn: one sender's
+# turns run one at a time, in arrival order (asyncio.Lock is FIFO), while
+# turns of different senders never wait on each other.
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # turns holding or waiting for the lock
+
+
+class SenderLocks:
+    """asyncio.Lock per sender, kept only while that sender has a turn in flight."""
+
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self.turns = 0
+        self.contended = 0
+        self.max_queue = 0
+
+    @asynccontextmanager
+    async def hold(self, sender_id: str) -> AsyncIterator[None]:
+        # Only touched from the event loop, so the bookkeeping needs no lock of its own
+        entry = self._entries.get(sender_id)
+        if entry is None:
+            entry = self._entries[sender_id] = _Entry()
+        entry.users += 1
+        self.turns += 1
+        if entry.users > 1:
+            self.contended += 1
+            self.max_queue = max(self.max_queue, entry.users - 1)
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._entries[sender_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "senders_in_flight": len(self._entries),
+            "turns": self.turns,
+            "contended": self.contended,
+            "max_queue": self.max_queue,
+        }
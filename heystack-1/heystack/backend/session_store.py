@@ -0,0 +1,628 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# --- Session persistence backends ---
+# action.py only talks to a SessionStore: load one sender, save one sender.
+# Backends decide how (and how cheaply) that reaches the disk.
+
+
+class SessionStore:
+    """Base interface for per-sender session persistence."""
+
+    def load(self, sender_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save(self, sender_id: str, session: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def save_many(self, items: Sequence[Tuple[str, Dict[str, Any]]]) -> None:
+        """Save several senders at once; backends that can write them together override this."""
+        for sender_id, session in items:
+            self.save(sender_id, session)
+
+    def disk_bytes(self) -> int:
+        """Size of the store's files on disk."""
+        return 0
+
+    def close(self) -> None:
+        pass
+
+
+def _file_bytes(*paths: str) -> int:
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+def _utf8_bytes(text: str) -> int:
+    # Sessions are serialised with ensure_ascii=False: count bytes, not characters
+    return len(text.encode("utf-8"))
+
+
+def _drop_torn_tail(path: str, block: int = 1 << 16) -> None:
+    """Truncate path after its last newline, dropping a line torn by a crash mid-write."""
+    with open(path, "rb+") as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        keep = 0
+        while pos > 0:
+            start = max(0, pos - block)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline >= 0:
+                keep = start + newline + 1
+                break
+            pos = start
+        if keep < end:
+            f.truncate(keep)
+
+
+def _read_json_file(path: str) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError:
+            return {}  # file was empty or broken — start fresh
+    return data if isinstance(data, dict) else {}
+
+
+class JournalSessionStore(SessionStore):
+    """
+    Snapshot + append-only journal.
+
+    Every save() appends one line holding only the keys that changed for that
+    sender, so a turn costs O(changed keys) instead of rewriting every session.
+    Once the journal holds `compact_every` entries it is rotated and folded
+    into the snapshot on a background thread. On startup the snapshot is
+    loaded and any journals are replayed; a torn last line (crash mid-write)
+    is ignored.
+
+    Not bounded: the last persisted copy of every sender ever seen stays in
+    memory (deltas and snapshots are computed from it), so a SessionCache in
+    front of this store limits live sessions but not the process's memory.
+    Use SQLiteSessionStore when the number of senders keeps growing.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: Optional[str] = None,
+                 compact_every: int = 1000, fsync: bool = False):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or snapshot_path + ".journal"
+        self.rotated_path = self.journal_path + ".1"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.bytes_written = 0
+
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()
+        # Last persisted copy of each session; deltas are computed against it
+        self._state: Dict[str, Dict[str, Any]] = self._recover()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._entries = 0
+        if os.path.exists(self.rotated_path) or os.path.getsize(self.journal_path):
+            self.compact(wait=True)
+
+    # --- Recovery ---
+    def _recover(self) -> Dict[str, Dict[str, Any]]:
+        state = _read_json_file(self.snapshot_path)
+        # Deltas hold absolute values, so replaying one already folded into
+        # the snapshot is harmless
+        for path in (self.rotated_path, self.journal_path):
+            if os.path.exists(path):
+                self._replay(path, state)
+        return state
+
+    @staticmethod
+    def _replay(path: str, state: Dict[str, Dict[str, Any]]) -> None:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn write at the tail — nothing valid follows it
+                session = state.setdefault(entry["s"], {})
+                session.update(entry.get("set", {}))
+                for key in entry.get("del", []):
+                    session.pop(key, None)
+
+    # --- SessionStore API ---
+    def load(self, sender_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._state.get(sender_id)
+            return dict(session) if session is not None else None
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {sender: dict(session) for sender, session in self._state.items()}
+
+    def save(self, sender_id: str, session: Dict[str, Any]) -> None:
+        self.save_many([(sender_id, session)])
+
+    def save_many(self, items: Sequence[Tuple[str, Dict[str, Any]]]) -> None:
+        # All the senders' lines go out in one write (and one fsync)
+        with self._lock:
+            saved: Dict[str, Dict[str, Any]] = {}
+            lines = []
+            for sender_id, session in items:
+                persisted = saved.get(sender_id, self._state.get(sender_id))
+                if persisted is None:
+                    changed, removed = dict(session), []
+                else:
+                    changed = {k: v for k, v in session.items() if k not in persisted or persisted[k] != v}
+                    removed = [k for k in persisted if k not in session]
+                    if not changed and not removed:
+                        continue
+
+                entry: Dict[str, Any] = {"s": sender_id, "set": changed}
+                if removed:
+                    entry["del"] = removed
+                lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+                saved[sender_id] = dict(session)
+            if not lines:
+                return
+
+            data = "".join(lines)
+            self._journal.write(data)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self.bytes_written += _utf8_bytes(data)
+
+            self._state.update(saved)
+            self._entries += len(lines)
+            due = self._entries >= self.compact_every
+
+        if due:
+            self.compact()
+
+    # --- Compaction ---
+    def compact(self, wait: bool = False) -> None:
+        # Only one compaction at a time; a turn that finds one running moves on
+        if not self._compacting.acquire(blocking=wait):
+            return
+
+        with self._lock:
+            # Rotate the journal so new turns keep appending while the
+            # snapshot is written from a frozen copy
+            self._journal.close()
+            if os.path.exists(self.rotated_path):
+                # A previous run died mid-compaction; fold both journals. The
+                # rotated one may end in a torn line, which would swallow the
+                # first line appended after it
+                _drop_torn_tail(self.rotated_path)
+                with open(self.rotated_path, "a", encoding="utf-8") as dst, \
+                        open(self.journal_path, "r", encoding="utf-8") as src:
+                    dst.write(src.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.rotated_path)
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._entries = 0
+            frozen = {sender: dict(session) for sender, session in self._state.items()}
+
+        if wait:
+            self._write_snapshot(frozen)
+        else:
+            threading.Thread(target=self._write_snapshot, args=(frozen,), daemon=True).start()
+
+    def _write_snapshot(self, frozen: Dict[str, Dict[str, Any]]) -> None:
+        try:
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(frozen, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            os.remove(self.rotated_path)
+        finally:
+            self._compacting.release()
+
+    def disk_bytes(self) -> int:
+        return _file_bytes(self.snapshot_path, self.journal_path, self.rotated_path)
+
+    def close(self) -> None:
+        self.compact(wait=True)
+        with self._lock:
+            self._journal.close()
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    One row per sender in an SQLite file, loaded lazily on first access.
+
+    save() only queues the serialised session; a writer thread waits
+    `commit_window` seconds so that every turn saved in that window lands in
+    the same transaction — one fsync shared by many concurrent /chat calls.
+    """
+
+    def __init__(self, path: str, commit_window: float = 0.005, import_from: Optional[str] = None):
+        self.path = path
+        self.commit_window = commit_window
+        self.bytes_written = 0
+        self.commits = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (sender TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._db_lock = threading.Lock()
+        self._pending: Dict[str, str] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+
+        if import_from:
+            self._import_json(import_from)
+
+        self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+        self._writer.start()
+
+    def _import_json(self, path: str) -> None:
+        # One-off migration from the old chat_memory.json, only into an empty table
+        if self._conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone():
+            return
+        rows = [(sender, json.dumps(session, ensure_ascii=False))
+                for sender, session in _read_json_file(path).items()]
+        if rows:
+            self._write_rows(rows)
+
+    def _write_rows(self, rows) -> None:
+        self._conn.execute("BEGIN")
+        self._conn.executemany(
+            "INSERT INTO sessions (sender, data) VALUES (?, ?) "
+            "ON CONFLICT(sender) DO UPDATE SET data = excluded.data",
+            rows,
+        )
+        self._conn.execute("COMMIT")
+        self.commits += 1
+        self.bytes_written += sum(_utf8_bytes(data) for _, data in rows)
+
+    # --- Group commit ---
+    def _write_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._pending:
+                    return
+            time.sleep(self.commit_window)  # let concurrent turns join this commit
+            self.flush()
+
+    def flush(self) -> None:
+        with self._db_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+            if batch:
+                self._write_rows(list(batch.items()))
+
+    # --- SessionStore API ---
+    def load(self, sender_id: str) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            data = self._pending.get(sender_id)
+        if data is None:
+            with self._db_lock:
+                row = self._conn.execute("SELECT data FROM sessions WHERE sender = ?", (sender_id,)).fetchone()
+            if row is None:
+                return None
+            data = row[0]
+        return json.loads(data)
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute("SELECT sender, data FROM sessions").fetchall()
+        return {sender: json.loads(data) for sender, data in rows}
+
+    def save(self, sender_id: str, session: Dict[str, Any]) -> None:
+        data = json.dumps(session, ensure_ascii=False)
+        with self._cond:
+            self._pending[sender_id] = data  # a later save in the same window replaces it
+            self._cond.notify()
+
+    def save_many(self, items: Sequence[Tuple[str, Dict[str, Any]]]) -> None:
+        # Queued together, so they land in the same commit
+        rows = [(sender_id, json.dumps(session, ensure_ascii=False)) for sender_id, session in items]
+        with self._cond:
+            self._pending.update(rows)
+            self._cond.notify()
+
+    def disk_bytes(self) -> int:
+        return _file_bytes(self.path, self.path + "-wal")
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+class SessionCache:
+    """
+    Bounded LRU + idle-TTL cache of live sessions in front of a SessionStore.
+
+    Entries are kept in access order, so both the least recently used and the
+    longest idle sessions sit at the front. Evicted sessions are written back
+    to the store and reloaded from it when the sender returns. put() evicts
+    as it goes; with sweep_interval > 0 a background thread also expires idle
+    sessions when no new sender arrives. Memory is only bounded if the store
+    does not keep every session itself (the journal store does).
+    """
+
+    def __init__(self, store: SessionStore, max_entries: int = 10000, ttl: float = 1800.0,
+                 sweep_interval: float = 0.0):
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        if sweep_interval > 0:
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(sweep_interval,),
+                                             name="session-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def get_live(self, sender_id: str) -> Optional[Dict[str, Any]]:
+        """The cached session if it is live (counted as a hit), else None; never touches the store."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(sender_id)
+            if entry is None or now - entry[1] > self.ttl:
+                return None
+            self.hits += 1
+            self._entries[sender_id] = (entry[0], now)
+            self._entries.move_to_end(sender_id)
+            return entry[0]
+
+    def get(self, sender_id: str, default_factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(sender_id)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self.hits += 1
+                self._entries[sender_id] = (entry[0], now)
+                self._entries.move_to_end(sender_id)
+                return entry[0]
+            self.misses += 1
+
+        session = self.store.load(sender_id) if entry is None else entry[0]
+        if session is None:
+            session = default_factory()
+        self.put(sender_id, session)
+        return session
+
+    def put(self, sender_id: str, session: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._entries[sender_id] = (session, now)
+            self._entries.move_to_end(sender_id)
+            evicted = self._evict(now)
+        for evicted_id, evicted_session in evicted:
+            self.store.save(evicted_id, evicted_session)
+
+    def sweep(self) -> int:
+        """Write back and drop every session idle for longer than the TTL; returns how many."""
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+        for evicted_id, evicted_session in evicted:
+            self.store.save(evicted_id, evicted_session)
+        return len(evicted)
+
+    def _sweep_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception:
+                pass  # keep sweeping; the write-back repeats a save already made when the turn committed
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
+
+    def _evict(self, now: float):
+        evicted = []
+        while self._entries:
+            sender_id, (session, last_access) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - last_access <= self.ttl:
+                break
+            del self._entries[sender_id]
+            evicted.append((sender_id, session))
+        self.evictions += len(evicted)
+        return evicted
+
+    def __getitem__(self, sender_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._entries[sender_id][0]
+
+    def __setitem__(self, sender_id: str, session: Dict[str, Any]) -> None:
+        self.put(sender_id, session)
+
+    def __contains__(self, sender_id: str) -> bool:
+        with self._lock:
+            return sender_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            snapshot = [(sender_id, session) for sender_id, (session, _) in self._entries.items()]
+        return iter(snapshot)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class VersionedSQLiteSessionStore(SessionStore):
+    """
+    Sessions shared by several server processes through one SQLite file.
+
+    For `uvicorn action:app --workers N`: every worker opens the same WAL
+    database and nothing is cached between turns, so each turn starts from
+    the latest committed session whichever worker committed it. Rows carry
+    a version; save_if() only writes when the row is still at the version
+    the turn loaded, so two workers handling the same sender at once cannot
+    overwrite each other's turn. The loser re-runs its turn on the fresh
+    session (optimistic concurrency).
+    """
+
+    def __init__(self, path: str, import_from: Optional[str] = None, busy_timeout: float = 5.0):
+        self.path = path
+        self.bytes_written = 0
+        self.loads = 0
+        self.commits = 0
+        self.conflicts = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=busy_timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: a commit survives a crashed worker; only an OS crash can drop the last few
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Workers start together: check and migrate the schema in one write transaction, so only one adds the column
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sessions "
+                               "(sender TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 0)")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")]
+            if "version" not in columns:
+                # Table written by SQLiteSessionStore: same rows, versions start at 0
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._db_lock = threading.Lock()
+
+        if import_from:
+            self._import_json(import_from)
+
+    def _import_json(self, path: str) -> None:
+        # Every worker runs this at start-up; INSERT OR IGNORE keeps the race between them harmless
+        with self._db_lock:
+            if self._conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone():
+                return
+            rows = [(sender, json.dumps(session, ensure_ascii=False))
+                    for sender, session in _read_json_file(path).items()]
+            if rows:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany("INSERT OR IGNORE INTO sessions (sender, data, version) VALUES (?, ?, 1)",
+                                       rows)
+                self._conn.execute("COMMIT")
+
+    # --- Versioned access ---
+    def load_versioned(self, sender_id: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """(session, version); (None, 0) for a sender with no saved session."""
+        with self._db_lock:
+            row = self._conn.execute("SELECT data, version FROM sessions WHERE sender = ?", (sender_id,)).fetchone()
+            self.loads += 1
+        if row is None:
+            return None, 0
+        return json.loads(row[0]), row[1]
+
+    def save_if(self, sender_id: str, session: Dict[str, Any], version: int) -> bool:
+        """Write `session` as version + 1 unless another turn committed since `version` was loaded."""
+        data = json.dumps(session, ensure_ascii=False)
+        with self._db_lock:
+            # Each statement is its own transaction: compare and write are atomic
+            if version == 0:
+                cursor = self._conn.execute(
+                    "INSERT INTO sessions (sender, data, version) VALUES (?, ?, 1) ON CONFLICT(sender) DO NOTHING",
+                    (sender_id, data))
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE sessions SET data = ?, version = version + 1 WHERE sender = ? AND version = ?",
+                    (data, sender_id, version))
+            if cursor.rowcount != 1:
+                self.conflicts += 1
+                return False
+            self.commits += 1
+            self.bytes_written += _utf8_bytes(data)
+            return True
+
+    def save_many_if(self, items: Sequence[Tuple[str, Dict[str, Any], int]]) -> List[bool]:
+        """save_if() for several senders in one transaction; one flag per item, the others commit regardless."""
+        rows = [(sender_id, json.dumps(session, ensure_ascii=False), version) for sender_id, session, version in items]
+        saved = []
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sender_id, data, version in rows:
+                    if version == 0:
+                        cursor = self._conn.execute(
+                            "INSERT INTO sessions (sender, data, version) VALUES (?, ?, 1) "
+                            "ON CONFLICT(sender) DO NOTHING", (sender_id, data))
+                    else:
+                        cursor = self._conn.execute(
+                            "UPDATE sessions SET data = ?, version = version + 1 WHERE sender = ? AND version = ?",
+                            (data, sender_id, version))
+                    saved.append(cursor.rowcount == 1)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.commits += 1
+            self.conflicts += saved.count(False)
+            self.bytes_written += sum(_utf8_bytes(data) for (_, data, _), ok in zip(rows, saved) if ok)
+        return saved
+
+    # --- SessionStore API ---
+    def load(self, sender_id: str) -> Optional[Dict[str, Any]]:
+        return self.load_versioned(sender_id)[0]
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        with self._db_lock:
+            rows = self._conn.execute("SELECT sender, data FROM sessions").fetchall()
+        return {sender: json.loads(data) for sender, data in rows}
+
+    def save(self, sender_id: str, session: Dict[str, Any]) -> None:
+        # Unconditional (last writer wins); turns go through save_if
+        data = json.dumps(session, ensure_ascii=False)
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO sessions (sender, data, version) VALUES (?, ?, 1) "
+                "ON CONFLICT(sender) DO UPDATE SET data = excluded.data, version = version + 1",
+                (sender_id, data))
+            self.commits += 1
+            self.bytes_written += _utf8_bytes(data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "shared",
+            "pid": os.getpid(),
+            "loads": self.loads,
+            "commits": self.commits,
+            "conflicts": self.conflicts,
+        }
+
+    def disk_bytes(self) -> int:
+        return _file_bytes(self.path, self.path + "-wal")
+
+    def close(self) -> None:
+        with self._db_lock:
+            self._conn.close()
@@ -0,0 +1,247 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# --- Slow-turn traces ---
+# Opt-in: a turn that takes longer than the threshold is written to a JSON
+# file in a rotating directory (oldest files deleted past `keep`), tagged
+# with the sender, the detected intent and the session states that were
+# active when it arrived. Each file holds the turn's stage timeline (the
+# chat_stage_seconds stages, with their offsets into the turn) and, when
+# sampling is on, folded stacks of every thread in the process sampled while
+# the turn ran: the event loop shows what held it up (other senders' turns,
+# session saves, the loop itself), the retrieval threads what the lookup was
+# doing. `jq -r '.profile.folded[]' FILE | flamegraph.pl > turn.svg` draws
+# it (speedscope reads the same lines). Retrieval in a process pool runs
+# outside these samples; its time still shows as the "retrieve" stage.
+#
+# Fast turns cost a context-variable set and a clock read; stages are only
+# appended for the turn in flight. The sampler wakes every sample interval
+# only while turns are in flight, and files are written on a background
+# thread, so a burst of slow turns never blocks the event loop on disk
+# (traces beyond the queue are counted as dropped).
+
+# Samples kept for turns still in flight; a turn longer than this keeps only its last part
+SAMPLE_WINDOW_SECONDS = 10.0
+QUEUE_SIZE = 64
+FILE_PREFIX = "slow-"
+
+Stack = Tuple[Any, ...]  # code objects, outermost first
+
+_CURRENT: ContextVar[Optional["TurnTrace"]] = ContextVar("slow_turn_trace", default=None)
+
+
+class TurnTrace:
+    """Stages and tags of one turn in flight."""
+
+    __slots__ = ("sender", "wall", "started", "stages", "tags")
+
+    def __init__(self, sender: str):
+        self.sender = sender
+        self.wall = time.time()
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float, float]] = []  # (stage, ended at (s into the turn), seconds)
+        self.tags: Dict[str, Any] = {}
+
+
+class _Sampler:
+    """Background thread snapshotting every thread's stack while `busy()` is true."""
+
+    def __init__(self, interval: float, busy: Callable[[], bool]):
+        self.interval = interval
+        self.busy = busy
+        self._samples: Deque[Tuple[float, List[Tuple[int, Stack]]]] = deque(
+            maxlen=max(1, int(SAMPLE_WINDOW_SECONDS / interval)))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.ignore = set()  # thread idents left out of the samples (the sampler and the trace writer)
+        self.taken = 0
+        self._thread = threading.Thread(target=self._run, name="slow-turn-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        self.ignore.add(threading.get_ident())
+        while not self._stop.wait(self.interval):
+            if not self.busy():
+                continue
+            now = time.perf_counter()
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident in self.ignore:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                stacks.append((ident, tuple(codes)))
+            with self._lock:
+                self._samples.append((now, stacks))
+            self.taken += 1
+
+    def between(self, start: float, end: float) -> List[List[Tuple[int, Stack]]]:
+        with self._lock:
+            return [stacks for at, stacks in self._samples if start <= at <= end]
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+
+def _frame_label(code: Any, labels: Dict[Any, str]) -> str:
+    label = labels.get(code)
+    if label is None:
+        label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def fold(samples: List[List[Tuple[int, Stack]]]) -> List[str]:
+    """Samples as folded stacks ("thread;outer;...;inner count"), the input format of flame-graph tools."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    labels: Dict[Any, str] = {}
+    counts: Counter = Counter()
+    for stacks in samples:
+        for ident, codes in stacks:
+            frames = [names.get(ident, f"thread-{ident}")] + [_frame_label(code, labels) for code in codes]
+            counts[";".join(frame.replace(";", ":") for frame in frames)] += 1
+    return [f"{stack} {count}" for stack, count in sorted(counts.items())]
+
+
+class SlowTurnRecorder:
+    """
+    Writes a trace file for every turn slower than threshold_ms. A threshold
+    of 0 disables it: turn() then yields None and nothing else runs. context(),
+    if given, is called for each slow turn and its dict stored alongside (queue
+    depths and the like, as they stood when the turn ended).
+    """
+
+    def __init__(self, directory: str, threshold_ms: float = 0.0, keep: int = 200, sample_ms: float = 5.0,
+                 context: Optional[Callable[[], Dict[str, Any]]] = None):
+        self.directory = directory
+        self.threshold = threshold_ms / 1000
+        self.keep = keep
+        self.context = context
+        self.enabled = threshold_ms > 0
+        self.in_flight = 0
+        self.slow = 0
+        self.written = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self._seq = 0
+        self._queue: "queue.Queue[Optional[Tuple[float, float, float, Dict[str, Any]]]]" = queue.Queue(QUEUE_SIZE)
+        self._sampler: Optional[_Sampler] = None
+        self._writer: Optional[threading.Thread] = None
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            if sample_ms > 0:
+                self._sampler = _Sampler(sample_ms / 1000, lambda: self.in_flight > 0)
+            self._writer = threading.Thread(target=self._write_loop, name="slow-turn-writer", daemon=True)
+            self._writer.start()
+
+    @contextmanager
+    def turn(self, sender: str) -> Iterator[Optional[TurnTrace]]:
+        if not self.enabled:
+            yield None
+            return
+        trace = TurnTrace(sender)
+        token = _CURRENT.set(trace)
+        self.in_flight += 1
+        try:
+            yield trace
+        except BaseException as e:
+            trace.tags["error"] = repr(e)
+            raise
+        finally:
+            self.in_flight -= 1
+            _CURRENT.reset(token)
+            self._finish(trace)
+
+    def stage(self, stage: str, seconds: float) -> None:
+        trace = _CURRENT.get()
+        if trace is not None:
+            trace.stages.append((stage, time.perf_counter() - trace.started, seconds))
+
+    def _finish(self, trace: TurnTrace) -> None:
+        ended = time.perf_counter()
+        elapsed = ended - trace.started
+        if elapsed < self.threshold:
+            return
+        self.slow += 1
+        record = {
+            "sender": trace.sender,
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "threshold_ms": self.threshold * 1000,
+            "tags": trace.tags,
+            "stages": [{"stage": stage, "start_ms": round((end - seconds) * 1000, 3), "ms": round(seconds * 1000, 3)}
+                       for stage, end, seconds in trace.stages],
+            "context": self.context() if self.context is not None else {},
+        }
+        try:
+            self._queue.put_nowait((trace.wall, trace.started, ended, record))
+        except queue.Full:
+            self.dropped += 1
+
+    # --- Writer thread ---
+    def _write_loop(self) -> None:
+        if self._sampler is not None:
+            self._sampler.ignore.add(threading.get_ident())
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except OSError:
+                self.write_errors += 1
+
+    def _write(self, wall: float, started: float, ended: float, record: Dict[str, Any]) -> None:
+        if self._sampler is not None:
+            samples = self._sampler.between(started, ended)
+            record["profile"] = {"interval_ms": self._sampler.interval * 1000, "samples": len(samples),
+                                 "folded": fold(samples)}
+        self._seq += 1
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(wall)) + f"{int(wall % 1 * 1000):03d}Z"
+        record = {"time": stamp, "pid": os.getpid(), **record}
+        path = os.path.join(self.directory, f"{FILE_PREFIX}{stamp}-{os.getpid()}-{self._seq}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=1, ensure_ascii=False, default=str)
+            f.write("\n")
+        os.replace(path + ".tmp", path)
+        self.written += 1
+        self._rotate()
+
+    def _rotate(self) -> None:
+        # Names start with the UTC time, so name order is age order across server processes sharing the directory
+        files = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(FILE_PREFIX) and name.endswith(".json"))
+        for name in files[:max(0, len(files) - self.keep)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass  # another worker rotated it first
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._queue.put(None)  # traces already queued are written first
+            self._writer.join(timeout=5)
+            self._writer = None
+        if self._sampler is not None:
+            self._sampler.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold * 1000,
+            "slow_turns": self.slow,
+            "written": self.written,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors,
+            "samples": self._sampler.taken if self._sampler is not None else 0,
+        }
@@ -0,0 +1,67 @@
+"""
+Alias resolution cost as the keyword catalogue grows.
+
+    python benchmarks/bench_alias_index.py [--sizes 100,1000,10000,100000]
+
+Compares one Aho-Corasick pass (AliasIndex.entities) with testing every
+alias against the message in turn.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from alias_index import AliasIndex  # noqa: E402
+
+MESSAGES = [
+    "show me oud",
+    "can you play noura for me",
+    "i would like to know more about the musician and his most famous recordings",
+]
+
+
+def synthetic_aliases(n, seed=0):
+    rng = random.Random(seed)
+    for i in range(n):
+        words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+                 for _ in range(rng.randint(1, 3))]
+        yield " ".join(words), f"entity_{i % max(1, n // 4)}"
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'aliases':>8} {'build ms':>9} {'index us/msg':>13} {'scan us/msg':>12}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        aliases = list(synthetic_aliases(size))
+        aliases += [("show me oud", "oud_picture"), ("noura", "song1"), ("the musician", "farid")]
+
+        start = time.perf_counter()
+        index = AliasIndex()
+        for phrase, entity in aliases:
+            index.add(phrase, entity)
+        index.build()
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        index_us = sum(timed(lambda: index.entities(m), args.repeat) for m in MESSAGES) / len(MESSAGES)
+        scan_repeat = max(1, args.repeat * 100 // size)
+        scan_us = sum(timed(lambda: {e for p, e in aliases if p in m}, scan_repeat) for m in MESSAGES) / len(MESSAGES)
+        print(f"{size:>8} {build_ms:>9.1f} {index_us:>13.2f} {scan_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Load generator for the chat backend: scripted conversations from thousands of senders.
+
+    python benchmarks/bench_chat.py [--senders 2000] [--concurrency 64] [--serve | --url http://127.0.0.1:8000]
+
+Every simulated sender holds one conversation, turn after turn: greeting,
+name, the about-the-oud and how-to-play flows, a song, then knowledge-base
+questions (some asked by many senders, some unique). --concurrency
+conversations run at once. By default the app is driven in-process through
+httpx's ASGI transport; --serve starts `uvicorn action:app` on a free local
+port and drives it over the socket; --url targets a server that is already
+running.
+
+Reports throughput, client-side p50/p99 latency, the server's mean time per
+stage, resident memory growth and session bytes written per turn, the last
+three read from /metrics before and after the run (with --workers > 1 those
+come from whichever worker answers the scrape). In-process and --serve runs
+keep their sessions in a temporary directory (SESSION_DB / SESSION_JSON).
+Conversations are generated from --seed, so two runs send the same turns.
+The client is Python as well: on a machine with few cores it can saturate
+before the server does, so compare the latencies with the server's "turn"
+stage. In process it also shares the server's event loop and GIL, which
+holds up the retrieval threads; use --serve for retrieval latency.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+NAMES = ["omar", "my name is Lina", "I'm Sami", "skip", "Yara", "i am nour", "Karim", "prefer not to say"]
+ABOUT = ["understanding the oud", "history", "structure", "show me oud", "sound of oud", "what's the difference"]
+PLAY = ["how to play", "tuning", "yes", "basic strokes", "advanced technique", "video"]
+SONGS = [("famous song", "1"), ("learn song", "2"), ("oud songs", "leila")]
+SMALL_TALK = ["okay", "thanks", "nice", "tell me more", "nope"]
+QUESTIONS = [
+    "what wood is the oud made of",
+    "how many strings does the oud have",
+    "why does the oud have no frets",
+    "what is a risha",
+    "where does the oud come from",
+    "how do i hold the oud",
+    "what is a maqam",
+    "who are famous oud players",
+]
+
+
+def conversation(rng: random.Random) -> List[str]:
+    turns = ["", rng.choice(NAMES)]
+    turns += rng.sample(ABOUT, rng.randint(1, 3))
+    turns += PLAY[:rng.randint(1, len(PLAY))]
+    if rng.random() < 0.6:
+        turns += list(rng.choice(SONGS))
+    turns += rng.sample(SMALL_TALK, rng.randint(0, 2))
+    for _ in range(rng.randint(1, 3)):
+        question = rng.choice(QUESTIONS)
+        # A third of the questions are worded uniquely, so they miss the result cache
+        turns.append(question if rng.random() < 0.66 else f"{question} {rng.choice(['please', 'exactly', 'today'])} "
+                                                           f"{rng.randrange(10 ** 6)}")
+    return turns
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            values[name] = float(value)
+    return values
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass  # server still starting
+        if time.monotonic() > deadline:
+            raise SystemExit(f"server not ready after {timeout:.0f}s")
+        await asyncio.sleep(0.1)
+
+
+async def drive(client: httpx.AsyncClient, conversations: List[Tuple[str, List[str]]],
+                concurrency: int) -> Tuple[List[float], int, float]:
+    latencies: List[float] = []
+    errors = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def converse(sender: str, turns: List[str]) -> None:
+        nonlocal errors
+        async with gate:
+            for message in turns:
+                start = time.perf_counter()
+                response = await client.post("/chat", json={"sender": sender, "message": message})
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(converse(sender, turns) for sender, turns in conversations))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run(args, base_url: str = "", app=None) -> Dict[str, object]:
+    rng = random.Random(args.seed)
+    conversations = [(f"bench-{args.seed}-{i}", conversation(rng)) for i in range(args.senders)]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    transport = httpx.ASGITransport(app=app) if app is not None else None
+    async with httpx.AsyncClient(base_url=base_url or "http://bench", transport=transport, limits=limits,
+                                 timeout=60) as client:
+        await wait_ready(client, args.ready_timeout)
+        before = parse_metrics((await client.get("/metrics")).text)
+        latencies, errors, elapsed = await drive(client, conversations, args.concurrency)
+        await asyncio.sleep(0.2)  # let the last group commit land
+        after = parse_metrics((await client.get("/metrics")).text)
+
+    def delta(name: str) -> float:
+        return after.get(name, 0.0) - before.get(name, 0.0)
+
+    turns = len(latencies)
+    stages = {}
+    for key in after:
+        if key.startswith("chat_stage_seconds_count"):
+            stage = key[key.index('"') + 1:key.rindex('"')]
+            count = delta(key)
+            if count:
+                stages[stage] = delta(key.replace("_count", "_sum")) / count * 1000
+    return {
+        "senders": args.senders,
+        "turns": turns,
+        "errors": errors,
+        "seconds": elapsed,
+        "turns_per_second": turns / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "stage_mean_ms": stages,
+        "rss_growth_mb": delta("process_resident_memory_bytes") / 1e6,
+        "written_bytes_per_turn": delta("chat_session_store_written_bytes_total") / turns,
+        "store_growth_bytes_per_turn": delta("chat_session_store_disk_bytes") / turns,
+        "fallback_share": sum(delta(k) for k in after if k.startswith("chat_fallbacks_total"))
+                          / max(1.0, sum(delta(k) for k in after if k.startswith("chat_turns_total"))),
+    }
+
+
+def in_process(args, workdir: str) -> Dict[str, object]:
+    os.environ.setdefault("SESSION_DB", os.path.join(workdir, "chat_memory.db"))
+    os.environ.setdefault("SESSION_JSON", os.path.join(workdir, "chat_memory.json"))
+    sys.path.insert(0, BACKEND)
+    import action
+    return asyncio.run(run(args, app=action.app))
+
+
+def served(args, workdir: str) -> Dict[str, object]:
+    port = free_port()
+    env = dict(os.environ, SESSION_DB=os.path.join(workdir, "chat_memory.db"),
+               SESSION_JSON=os.path.join(workdir, "chat_memory.json"))
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "action:app", "--port", str(port),
+                               "--workers", str(args.workers), "--log-level", "warning"], cwd=BACKEND, env=env)
+    try:
+        return asyncio.run(run(args, base_url=f"http://127.0.0.1:{port}"))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def report(results: Dict[str, object]) -> None:
+    print(f"{results['turns']} turns from {results['senders']} senders in {results['seconds']:.2f}s "
+          f"({results['errors']} errors)")
+    print(f"throughput {results['turns_per_second']:.0f} turns/s, latency p50 {results['p50_ms']:.2f} ms, "
+          f"p99 {results['p99_ms']:.2f} ms, max {results['max_ms']:.2f} ms")
+    print("server stage means (ms): " + ", ".join(f"{stage} {ms:.3f}" for stage, ms in
+                                                  sorted(results["stage_mean_ms"].items())))
+    print(f"rss growth {results['rss_growth_mb']:.1f} MB, session bytes written {results['written_bytes_per_turn']:.0f}"
+          f"/turn, store growth {results['store_growth_bytes_per_turn']:.0f} B/turn, "
+          f"fallback share {results['fallback_share']:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--senders", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--serve", action="store_true", help="start uvicorn on a local port and drive it")
+    target.add_argument("--url", help="drive a running server")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers with --serve")
+    parser.add_argument("--ready-timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-chat-") as workdir:
+        if args.url:
+            results = asyncio.run(run(args, base_url=args.url.rstrip("/")))
+        elif args.serve:
+            results = served(args, workdir)
+        else:
+            results = in_process(args, workdir)
+    report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Per-message cost of extract_name.
+
+    python benchmarks/bench_extract_name.py [--repeat 20000]
+
+Covers each way a name is found (or not): the opt-out phrases, "my name
+is", "I'm", a bare word, and longer messages that match none of them.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from flows import extract_name  # noqa: E402
+
+MESSAGES = [
+    "omar",
+    "My name is Lina",
+    "i'm sami al-khoury",
+    "I am Nour",
+    "skip",
+    "I'd prefer not to say",
+    "hello there",
+    "why are you called al-atrash?",
+    "i was wondering whether the instrument my grandfather left me is worth restoring " * 4,
+]
+
+
+def measure(repeat):
+    """[(message, extracted name, microseconds per call)]"""
+    rows = []
+    for message in MESSAGES:
+        name = extract_name(message)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            extract_name(message)
+        rows.append((message, name, (time.perf_counter() - start) / repeat * 1e6))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    rows = measure(args.repeat)
+    print(f"{'message':<48} {'name':<18} {'us/msg':>8}")
+    for message, name, per_msg in rows:
+        print(f"{message[:46]!r:<48} {name!r:<18} {per_msg:8.2f}")
+    print(f"{'mean':<67} {sum(r[2] for r in rows) / len(rows):8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Per-message cost of detect_intent.
+
+    python benchmarks/bench_intents.py [--repeat 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from intents import detect_intent  # noqa: E402
+
+MESSAGES = [
+    "hello",
+    "why are you called al-atrash?",
+    "understanding the oud",
+    "history",
+    "which oud should i buy",
+    "how do i tune it",
+    "show me oud",
+    "hear the sound of string",
+    "what's the difference between them",
+    "okay",
+    "nope",
+    "can you elaborate on that",
+    "famous song",
+    "what is a maqam and how is it used in classical arabic music",  # falls through every rule
+    "i was wondering whether the instrument my grandfather left me is worth restoring " * 4,
+]
+
+
+def measure(repeat):
+    """[(message, intent, microseconds per call)]"""
+    session = {"last_topic": None, "awaiting_string_audio": False}
+    rows = []
+    for message in MESSAGES:
+        intent = detect_intent(message, dict(session))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            detect_intent(message, dict(session))
+        rows.append((message, intent, (time.perf_counter() - start) / repeat * 1e6))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    rows = measure(args.repeat)
+    print(f"{'message':<48} {'intent':<22} {'us/msg':>8}")
+    for message, intent, per_msg in rows:
+        print(f"{message[:46]!r:<48} {intent:<22} {per_msg:8.2f}")
+    print(f"{'mean':<71} {sum(r[2] for r in rows) / len(rows):8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+retrieve_best_answer cost through the KnowledgeBase as the knowledge base grows.
+
+    python benchmarks/bench_knowledge_base.py [--sizes 1000,10000,100000] [--engine tfidf] [--queries 200]
+
+Writes the synthetic KB of bench_retrieval.py as .txt files to a temporary
+directory and opens it the way action.py does. Reports start-up cost (fit
+from the files, write the prebuilt index, memory-map it), then per-query
+latency of KnowledgeBase.retrieve, which is what retrieve_best_answer calls:
+distinct questions (result-cache misses), the same questions again (hits),
+and retrieve_many per question.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from bench_retrieval import synthetic_kb, synthetic_queries, synthetic_vocabulary  # noqa: E402
+from knowledge import KnowledgeBase  # noqa: E402
+from retrieval import ENGINES, save_index  # noqa: E402
+
+PARAGRAPHS_PER_FILE = 1000
+
+
+def write_kb(root, paragraphs):
+    for start in range(0, len(paragraphs), PARAGRAPHS_PER_FILE):
+        with open(os.path.join(root, f"kb_{start // PARAGRAPHS_PER_FILE:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs[start:start + PARAGRAPHS_PER_FILE]) + "\n")
+
+
+def per_query_us(fn, queries):
+    start = time.perf_counter()
+    fn(queries)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+def measure(size, engine, n_queries, top_k=2, vocabulary_size=20000):
+    """Start-up seconds and per-query microseconds for one KB size."""
+    vocabulary = synthetic_vocabulary(vocabulary_size)
+    paragraphs = synthetic_kb(size, vocabulary)
+    queries = [q for q, _ in synthetic_queries(paragraphs, vocabulary, n_queries)]
+    with tempfile.TemporaryDirectory(prefix="bench-kb-") as workdir:
+        kb_root = os.path.join(workdir, "data")
+        index_dir = os.path.join(workdir, "oud_knowledge.index")
+        os.makedirs(kb_root)
+        write_kb(kb_root, paragraphs)
+
+        start = time.perf_counter()
+        fitted = KnowledgeBase(kb_root, engine).load()
+        fit_s = time.perf_counter() - start
+        start = time.perf_counter()
+        save_index(fitted.retriever, engine, index_dir, kb_root)
+        save_s = time.perf_counter() - start
+        start = time.perf_counter()
+        kb = KnowledgeBase(kb_root, engine, index_dir, cache_size=2 * n_queries).load()
+        map_s = time.perf_counter() - start
+
+        miss_us = per_query_us(lambda qs: [kb.retrieve(q, top_k) for q in qs], queries)
+        hit_us = per_query_us(lambda qs: [kb.retrieve(q, top_k) for q in qs], queries)
+        kb.cache.clear()
+        batch_us = per_query_us(lambda qs: kb.retrieve_many(qs, top_k), queries)
+        return {"paragraphs": size, "source": kb.source, "fit_s": fit_s, "save_index_s": save_s, "map_index_s": map_s,
+                "miss_us": miss_us, "hit_us": hit_us, "batch_us": batch_us}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--engine", default="tfidf", choices=sorted(ENGINES))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{'paragraphs':>10} {'fit s':>7} {'save s':>7} {'map ms':>7} {'miss us/q':>10} {'hit us/q':>9} "
+          f"{'batch us/q':>11}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        r = measure(size, args.engine, args.queries, args.top_k)
+        print(f"{size:>10} {r['fit_s']:>7.2f} {r['save_index_s']:>7.2f} {r['map_index_s'] * 1000:>7.1f} "
+              f"{r['miss_us']:>10.1f} {r['hit_us']:>9.1f} {r['batch_us']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
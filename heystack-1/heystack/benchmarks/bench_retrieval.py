@@ -0,0 +1,117 @@
+"""
+Knowledge-base retrieval engines as the knowledge base grows.
+
+    python benchmarks/bench_retrieval.py [--sizes 1000,10000,100000] [--queries 200]
+
+Builds a synthetic KB (Zipf-distributed vocabulary minus the stop-word
+head, 30-80 words per paragraph) and, for each engine, reports build time,
+per-query latency (one at a time and through retrieve_many) and recall@k:
+the share of queries whose source paragraph is among the k answers.
+Queries are a few words lifted from one paragraph plus unrelated noise
+words, like a user paraphrasing a fact.
+
+"argsort" is the original lookup (dense cosine_similarity over every
+paragraph + full argsort) on the TF-IDF engine's matrix; "agree" is the
+share of queries where the TF-IDF engine returns the same paragraphs.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from sklearn.metrics.pairwise import cosine_similarity  # noqa: E402
+
+from retrieval import ENGINES, MIN_SCORE  # noqa: E402
+
+
+STOP_WORDS = 300
+
+
+def synthetic_vocabulary(n, seed=0):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10))) for _ in range(n)]
+
+
+def synthetic_kb(n, vocabulary, seed=0):
+    rng = random.Random(seed)
+    # Zipf tail only: the head of a real word distribution is the stop words the vectorizer drops
+    weights = [1 / (rank + 1) for rank in range(STOP_WORDS, STOP_WORDS + len(vocabulary))]
+    return [" ".join(rng.choices(vocabulary, weights, k=rng.randint(30, 80))) for _ in range(n)]
+
+
+def synthetic_queries(paragraphs, vocabulary, n, seed=1):
+    """(query, index of the paragraph it was lifted from) pairs."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        source = rng.randrange(len(paragraphs))
+        words = paragraphs[source].split()
+        words = rng.sample(words, min(len(words), rng.randint(3, 8))) + rng.sample(vocabulary, rng.randint(0, 3))
+        rng.shuffle(words)
+        queries.append((" ".join(words), source))
+    return queries
+
+
+def baseline(retriever, query, top_k=2):
+    q_vec = retriever.query_matrix([query])
+    sims = cosine_similarity(q_vec, retriever.term_docs.T).flatten()
+    top_idx = sims.argsort()[::-1][:top_k]
+    return [retriever.paragraphs[i] for i in top_idx if sims[i] > MIN_SCORE]
+
+
+def per_query_us(fn, queries):
+    start = time.perf_counter()
+    fn(queries)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--top-k", type=int, default=2)
+    args = parser.parse_args()
+    k = args.top_k
+
+    vocabulary = synthetic_vocabulary(args.vocabulary)
+    print(f"{'paragraphs':>10} {'engine':>8} {'build s':>8} {'us/q':>10} {'batch us/q':>11} "
+          f"{f'recall@{k}':>9} {'agree':>6}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        paragraphs = synthetic_kb(size, vocabulary)
+        pairs = synthetic_queries(paragraphs, vocabulary, args.queries)
+        queries = [q for q, _ in pairs]
+
+        def recall(answers):
+            return sum(paragraphs[source] in found for (_, source), found in zip(pairs, answers)) / len(pairs)
+
+        for name, engine in ENGINES.items():
+            start = time.perf_counter()
+            try:
+                retriever = engine(paragraphs)
+            except ImportError as e:
+                # dense needs sentence-transformers
+                print(f"{size:>10} {name:>8} skipped: {e}")
+                continue
+            build_s = time.perf_counter() - start
+
+            answers = [retriever.retrieve(q, k) for q in queries]
+            single_us = per_query_us(lambda qs: [retriever.retrieve(q, k) for q in qs], queries)
+            batch_us = per_query_us(lambda qs: retriever.retrieve_many(qs, k), queries)
+            agree = ""
+            if name == "tfidf":
+                old = [baseline(retriever, q, k) for q in queries]
+                # Scores can tie; compare as sets so tie order does not count as a disagreement
+                agree = f"{sum(set(a) == set(b) for a, b in zip(old, answers)) / len(queries):.1%}"
+                argsort_us = per_query_us(lambda qs: [baseline(retriever, q, k) for q in qs], queries)
+                print(f"{size:>10} {'argsort':>8} {'':>8} {argsort_us:>10.1f} {'':>11} {recall(old):>9.1%}")
+            print(f"{size:>10} {name:>8} {build_s:>8.2f} {single_us:>10.1f} {batch_us:>11.1f} "
+                  f"{recall(answers):>9.1%} {agree:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Reproducible benchmark suite with a regression check.
+
+    python benchmarks/run_suite.py [--out results.json] [--baseline results.json] [--tolerance 0.25] [--quick]
+
+Runs fixed-seed, reduced-size versions of the other benchmarks and keeps one
+number per metric:
+
+    intents.mean_us, extract_name.mean_us     bench_intents.py, bench_extract_name.py
+    kb.<paragraphs>.miss_us, hit_us, ...      bench_knowledge_base.py (tfidf)
+    chat.turns_per_second, p50_ms, ...        bench_chat.py, in process
+
+With --baseline, every metric worse than the baseline by more than
+--tolerance (relative, plus a small absolute slack for near-zero metrics)
+is listed and the exit status is 1, so a CI job fails on a regression.
+Compare results from the same machine only.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+import bench_chat
+import bench_extract_name
+import bench_intents
+import bench_knowledge_base
+
+# metric suffix -> (higher is better, absolute slack)
+DIRECTIONS = {
+    "turns_per_second": (True, 0.0),
+    "rss_growth_mb": (False, 5.0),
+    "written_bytes_per_turn": (False, 16.0),
+    "map_index_ms": (False, 2.0),
+}
+DEFAULT_DIRECTION = (False, 0.0)
+
+
+def collect(quick: bool) -> dict:
+    results = {}
+    repeat = 2000 if quick else 20000
+    for name, module in (("intents", bench_intents), ("extract_name", bench_extract_name)):
+        rows = module.measure(repeat)
+        results[f"{name}.mean_us"] = sum(r[2] for r in rows) / len(rows)
+        print(f"{name}: {results[f'{name}.mean_us']:.2f} us/msg")
+
+    for size in ((1000,) if quick else (1000, 10000)):
+        r = bench_knowledge_base.measure(size, "tfidf", 200)
+        results.update({f"kb.{size}.miss_us": r["miss_us"], f"kb.{size}.hit_us": r["hit_us"],
+                        f"kb.{size}.batch_us": r["batch_us"], f"kb.{size}.map_index_ms": r["map_index_s"] * 1000})
+        print(f"kb {size}: miss {r['miss_us']:.1f} us, hit {r['hit_us']:.1f} us, batch {r['batch_us']:.1f} us/q")
+
+    args = argparse.Namespace(senders=200 if quick else 1000, concurrency=64, seed=0, ready_timeout=120.0)
+    with tempfile.TemporaryDirectory(prefix="bench-suite-") as workdir:
+        chat = bench_chat.in_process(args, workdir)
+    bench_chat.report(chat)
+    for key in ("turns_per_second", "p50_ms", "p99_ms", "rss_growth_mb", "written_bytes_per_turn"):
+        results[f"chat.{key}"] = chat[key]
+    return results
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    found = []
+    for name, old in baseline.items():
+        new = results.get(name)
+        if new is None:
+            continue
+        higher_better, slack = DIRECTIONS.get(name.rsplit(".", 1)[-1], DEFAULT_DIRECTION)
+        allowed = abs(old) * tolerance + slack
+        if (old - new if higher_better else new - old) > allowed:
+            found.append((name, old, new))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", help="write the results here (JSON)")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a smoke run")
+    args = parser.parse_args()
+
+    results = collect(args.quick)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "cpus": os.cpu_count(), "quick": args.quick, "metrics": results}, f, indent=2)
+            f.write("\n")
+    if not args.baseline:
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["metrics"]
+    found = regressions(results, baseline, args.tolerance)
+    for name, old, new in found:
+        print(f"REGRESSION {name}: {old:.3f} -> {new:.3f}")
+    print(f"{len(found)} regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
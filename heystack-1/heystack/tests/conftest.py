@@ -0,0 +1,18 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# The backend modules import each other as top-level modules (uvicorn runs from backend/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+# Tests that import action keep their sessions out of backend/chat_memory.*; registered before action's own
+# atexit handlers, so it runs after they have flushed the sessions
+_workdir = tempfile.mkdtemp(prefix="chat-tests-")
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.environ.setdefault("SESSION_DB", os.path.join(_workdir, "chat_memory.db"))
+os.environ.setdefault("SESSION_JSON", os.path.join(_workdir, "chat_memory.json"))
+os.environ.setdefault("KB_WATCH_SECONDS", "0")
+# Original media only, whatever build_media.py made locally: transcripts hold the originals' tags (see replay.py)
+os.environ.setdefault("MEDIA_MANIFEST", "")
@@ -0,0 +1,62 @@
+import math
+from collections import Counter
+
+import numpy as np
+
+from retrieval import BM25Retriever, analyzer
+
+PARAGRAPHS = [
+    "The oud is a short-neck lute with a pear-shaped body.",
+    "Oud strings are tuned in courses; the oud has eleven strings.",
+    "A maqam is a system of melodic modes used in Arabic music.",
+    "Farid al-Atrash played the oud and composed songs in many maqamat over a long and celebrated career "
+    "in Egyptian cinema, radio, theatre and recordings.",
+    "Tuning the oud: the courses are tuned in fourths.",
+]
+
+
+def reference_scores(query, k1=1.5, b=0.75):
+    analyze = analyzer()
+    docs = [Counter(analyze(p)) for p in PARAGRAPHS]
+    lengths = [sum(d.values()) for d in docs]
+    avg = sum(lengths) / len(lengths)
+    scores = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        for term in analyze(query):
+            df = sum(1 for d in docs if term in d)
+            if not df or term not in doc:
+                continue
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = doc[term]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg))
+        scores.append(score)
+    return scores
+
+
+def test_scores_match_okapi_bm25():
+    retriever = BM25Retriever(PARAGRAPHS)
+    for query in ("oud strings", "tuned courses", "maqam modes", "oud"):
+        scores, doc_ids = retriever.score(query)
+        expected = reference_scores(query)
+        best_possible = sum(retriever.idf[retriever.vocabulary[t]] for t in analyzer()(query)) * (retriever.k1 + 1)
+        full = np.zeros(len(PARAGRAPHS))
+        full[doc_ids] = scores
+        assert np.allclose(full * best_possible, expected)
+
+
+def test_rank_orders_by_score_and_cuts_off_misses():
+    retriever = BM25Retriever(PARAGRAPHS)
+    # The only paragraph with both terms, each twice
+    assert retriever.rank("oud strings", top_k=2)[0] == 1
+    # Long paragraphs are penalised: the short tuning paragraph beats the long one for "oud"
+    assert retriever.rank("oud", top_k=5).index(4) < retriever.rank("oud", top_k=5).index(3)
+    assert retriever.rank("maqam", top_k=3) == [2]
+    assert retriever.rank("violin piano", top_k=3) == []
+    assert retriever.rank_many(["maqam", "tuned courses"], top_k=1) == [[2], [4]]
+    assert retriever.retrieve("maqam") == [PARAGRAPHS[2]]
+
+
+def test_empty_knowledge_base():
+    retriever = BM25Retriever([])
+    assert retriever.rank("oud") == []
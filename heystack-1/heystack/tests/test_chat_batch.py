@@ -0,0 +1,59 @@
+import asyncio
+
+import httpx
+
+import action
+
+TURNS = ["", "Omar", "understanding the oud", "history", "how to play", "tuning", "thanks"]
+
+
+def turns_counted() -> float:
+    return sum(action.TURNS._values.values())
+
+
+async def post(path, body):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=action.app), base_url="http://test") as client:
+        response = await client.post(path, json=body)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_batch_matches_sequential_turns_and_counts_each_turn_once():
+    async def scenario():
+        sequential = [await post("/chat", {"sender": "batch-seq", "message": m}) for m in TURNS]
+        before = turns_counted()
+        batched = await post("/chat/batch", [{"sender": "batch-one", "message": m} for m in TURNS])
+        assert turns_counted() - before == len(TURNS)
+        for one, many in zip(sequential, batched):
+            assert one["responses"] == many["responses"]
+
+    asyncio.run(scenario())
+
+
+def test_conflicted_senders_are_replayed_under_their_lock(monkeypatch):
+    commit_sessions = action.commit_sessions
+    run_held_turn = action.run_held_turn
+    held_during_replay = []
+
+    async def lose_first_commit(loaded):
+        # As if another worker had committed a turn for "batch-lost" first
+        await commit_sessions({sender: value for sender, value in loaded.items() if sender != "batch-lost"})
+        return ["batch-lost"]
+
+    async def replay(sender, text, trace=None):
+        held_during_replay.append((sender, sender in action.SENDER_LOCKS._entries))
+        return await run_held_turn(sender, text, trace)
+
+    monkeypatch.setattr(action, "commit_sessions", lose_first_commit)
+    monkeypatch.setattr(action, "run_held_turn", replay)
+
+    async def scenario():
+        before = turns_counted()
+        payloads = [{"sender": sender, "message": m} for m in TURNS[:3] for sender in ("batch-lost", "batch-kept")]
+        batched = await post("/chat/batch", payloads)
+        assert len(batched) == len(payloads)
+        assert held_during_replay == [("batch-lost", True)] * 3
+        assert action.SENDER_LOCKS.stats()["senders_in_flight"] == 0
+        assert turns_counted() - before == len(payloads)
+
+    asyncio.run(scenario())
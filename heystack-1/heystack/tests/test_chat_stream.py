@@ -0,0 +1,86 @@
+import asyncio
+import json
+import threading
+
+import httpx
+import pytest
+
+import action
+from retrieval_pool import RetrievalPool
+
+QUESTION = "what is a maqam"  # no flow answers it once the name is known: knowledge-base fallback
+
+
+@pytest.fixture
+def blocked_pool(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+
+    def lookup(query):
+        started.set()
+        release.wait(5)
+        return [f"about {query}"]
+
+    pool = RetrievalPool(lookup, workers=4, max_pending=2)
+    monkeypatch.setattr(action, "RETRIEVAL_POOL", pool)
+    monkeypatch.setattr(action, "retrieval_ready", lambda: True)
+    yield pool, started, release
+    release.set()
+    pool.close()
+
+
+async def introduce(sender: str) -> None:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=action.app), base_url="http://test") as client:
+        for message in ("", "Omar"):
+            assert (await client.post("/chat", json={"sender": sender, "message": message})).status_code == 200
+
+
+async def stream_then_disconnect(sender: str, started: threading.Event) -> None:
+    # Raw ASGI, spec 2.3: Starlette cancels the streaming task when http.disconnect arrives
+    body = json.dumps({"sender": sender, "message": QUESTION}).encode()
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+             "method": "POST", "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream",
+             "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+             "client": ("127.0.0.1", 1), "server": ("test", 80)}
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        while not started.is_set():
+            await asyncio.sleep(0.005)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await action.app(scope, receive, send)
+
+
+def test_stream_disconnect_during_retrieval_releases_pool_slot(blocked_pool):
+    pool, started, release = blocked_pool
+
+    async def scenario():
+        for i in range(3):  # more disconnects than max_pending
+            sender = f"stream-disconnect-{i}"
+            await introduce(sender)
+            started.clear()
+            await stream_then_disconnect(sender, started)
+            release.set()  # let the abandoned lookup finish
+            for _ in range(100):
+                if not pool.in_flight:
+                    break
+                await asyncio.sleep(0.01)
+            assert pool.in_flight == 0
+            release.clear()
+        assert pool.cancelled == 3
+
+        release.set()
+        await introduce("stream-after")
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=action.app), base_url="http://test") as client:
+            response = await client.post("/chat/stream", json={"sender": "stream-after", "message": QUESTION})
+        assert f"about {QUESTION}" in response.text
+
+    asyncio.run(scenario())
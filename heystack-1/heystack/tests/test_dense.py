@@ -0,0 +1,82 @@
+import threading
+
+import numpy as np
+import pytest
+
+import embeddings
+from embeddings import QueryEmbedder
+from retrieval import DenseRetriever
+
+MODEL = "test-bag-of-words"
+VOCABULARY = ["oud", "strings", "maqam", "modes", "tuning", "fourths", "farid", "songs"]
+PARAGRAPHS = [
+    "The oud has eleven strings.",
+    "A maqam is a system of melodic modes.",
+    "Tuning the oud in fourths.",
+    "Farid al-Atrash composed songs.",
+]
+
+
+class BagOfWords:
+    """Stands in for a sentence-transformers model: one dimension per known word."""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size, normalize_embeddings, convert_to_numpy):
+        self.calls.append(list(texts))
+        vectors = np.array([[float(word in text.lower()) for word in VOCABULARY] for text in texts])
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms, norms, 1)
+
+    def get_sentence_embedding_dimension(self):
+        return len(VOCABULARY)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = BagOfWords()
+    embedder = QueryEmbedder(MODEL, window=0.02, max_batch=8, cache_size=16, model_loader=lambda name: model)
+    monkeypatch.setitem(embeddings._embedders, MODEL, embedder)
+    return model
+
+
+def test_dense_ranking_and_cut_off(model):
+    retriever = DenseRetriever(PARAGRAPHS, model=MODEL)
+    assert retriever.rank("oud strings", top_k=2)[0] == 0
+    assert retriever.rank("which MAQAM modes?", top_k=1) == [1]
+    assert retriever.rank("violin", top_k=2) == []
+    assert retriever.rank_many(["tuning in fourths", "", "farid songs"], top_k=1) == [[2], [], [3]]
+    assert retriever.retrieve("maqam") == [PARAGRAPHS[1]]
+
+
+def test_query_cache_and_paragraph_reuse(model):
+    retriever = DenseRetriever(PARAGRAPHS, model=MODEL)
+    retriever.rank("Oud  strings")
+    calls = len(model.calls)
+    retriever.rank("oud strings")  # same normalised question: cache hit
+    assert len(model.calls) == calls
+    assert retriever.stats()["hits"] >= 1
+
+    DenseRetriever(PARAGRAPHS + ["Maqam songs by Farid."], model=MODEL)  # a reload: only the new paragraph
+    assert model.calls[-1] == ["Maqam songs by Farid."]
+
+
+def test_concurrent_queries_share_a_batch(model):
+    retriever = DenseRetriever(PARAGRAPHS, model=MODEL)
+    queries = ["oud", "strings", "maqam", "modes", "tuning", "fourths"]
+    start = threading.Barrier(len(queries))
+    results = {}
+
+    def ask(query):
+        start.wait()
+        results[query] = retriever.rank(query, top_k=1)
+
+    threads = [threading.Thread(target=ask, args=(query,)) for query in queries]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {"oud": [0], "strings": [0], "maqam": [1], "modes": [1], "tuning": [2], "fourths": [2]}
+    stats = retriever.stats()
+    assert stats["batches"] < len(queries) and stats["largest_batch"] > 1
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from knowledge import KnowledgeBase
+from retrieval import MappedParagraphs, index_is_current, load_index, save_index
+
+QUERIES = ["oud strings", "maqam", "tuning in fourths", "farid al-atrash", "violin"]
+
+
+def is_mapped(array: np.ndarray) -> bool:
+    # Views (e.g. the CSR matrix's arrays) keep the memmap as their base
+    while array is not None and not isinstance(array, np.memmap):
+        array = array.base
+    return array is not None
+
+
+@pytest.fixture
+def kb_dir(tmp_path):
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "oud.md").write_text(
+        "# The oud\nThe oud is a short-neck lute with a pear-shaped body.\n\n"
+        "Oud strings are tuned in courses; the oud has eleven strings.\n\n"
+        "Tuning the oud: the courses are tuned in fourths.\n", encoding="utf-8")
+    (kb / "music.jsonl").write_text(
+        '{"text": "A maqam is a system of melodic modes — مقام — used in Arabic music."}\n'
+        '{"text": "Farid al-Atrash played the oud and composed songs in many maqamat."}\n', encoding="utf-8")
+    return kb
+
+
+@pytest.mark.parametrize("engine", ["tfidf", "bm25"])
+def test_save_and_load_round_trip(kb_dir, tmp_path, engine):
+    fitted = KnowledgeBase(str(kb_dir), engine).load().retriever
+    index_dir = str(tmp_path / "oud_knowledge.index")
+    save_index(fitted, engine, index_dir, str(kb_dir))
+    assert index_is_current(index_dir, str(kb_dir), engine)
+    assert not index_is_current(index_dir, str(kb_dir), "bm25" if engine == "tfidf" else "tfidf")
+
+    mapped = load_index(index_dir)
+    assert isinstance(mapped.paragraphs, MappedParagraphs)
+    assert list(mapped.paragraphs) == list(fitted.paragraphs)
+    assert mapped.vocabulary == fitted.vocabulary
+    for name, array in fitted.arrays().items():
+        assert is_mapped(mapped.arrays()[name])
+        assert np.array_equal(mapped.arrays()[name], array)
+    for query in QUERIES:
+        assert mapped.rank(query, top_k=3) == fitted.rank(query, top_k=3)
+    assert mapped.rank_many(QUERIES, top_k=2) == fitted.rank_many(QUERIES, top_k=2)
+
+
+def test_knowledge_base_maps_a_current_index_and_refits_a_stale_one(kb_dir, tmp_path):
+    index_dir = str(tmp_path / "oud_knowledge.index")
+    save_index(KnowledgeBase(str(kb_dir), "bm25").load().retriever, "bm25", index_dir, str(kb_dir))
+
+    kb = KnowledgeBase(str(kb_dir), "bm25", index_dir).load()
+    assert kb.source == "index"
+    assert "مقام" in kb.retrieve("maqam modes", top_k=1)[0]
+
+    with open(kb_dir / "oud.md", "a", encoding="utf-8") as f:
+        f.write("\nThe risha is the plectrum used to play the oud.\n")
+    assert not index_is_current(index_dir, str(kb_dir), "bm25")
+    kb = KnowledgeBase(str(kb_dir), "bm25", index_dir).load()
+    assert kb.source == "fit"
+    assert kb.retrieve("risha plectrum", top_k=1) == ["The risha is the plectrum used to play the oud."]
@@ -0,0 +1,50 @@
+import json
+import os
+
+from session_store import JournalSessionStore
+
+
+def test_bytes_written_counts_utf8_bytes(tmp_path):
+    store = JournalSessionStore(str(tmp_path / "sessions.json"), compact_every=100)
+    store.save("sara", {"user_name": "سارة", "last_topic": "عود"})
+    assert store.bytes_written == os.path.getsize(store.journal_path)
+    store.close()
+
+
+def test_replay_after_compaction(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    store = JournalSessionStore(path, compact_every=3)
+    for i in range(7):  # compacts twice, the last turn stays in the journal
+        store.save("sara", {"turn": i, "user_name": "Sara"})
+    store.save("omar", {"turn": 0})
+    store.save("sara", {"turn": 7})  # deletes user_name
+    store.compact(wait=True)
+    store.save("omar", {"turn": 1})
+    store._journal.close()  # crash: no close(), so no final compaction
+
+    reopened = JournalSessionStore(path)
+    assert reopened.load_all() == {"sara": {"turn": 7}, "omar": {"turn": 1}}
+    reopened.close()
+
+
+def test_interrupted_compaction_with_torn_rotated_journal(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    store = JournalSessionStore(path)
+    rotated = store.rotated_path
+    store.close()
+    # A crash mid-compaction left a rotated journal ending in a torn line, and turns went on in a new journal
+    with open(rotated, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"s": "sara", "set": {"turn": 1}}) + "\n" + '{"s": "sara", "se')
+    with open(store.journal_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"s": "omar", "set": {"turn": 2}}) + "\n")
+
+    # Fold the journals but die again before the snapshot is written
+    class Interrupted(JournalSessionStore):
+        def _write_snapshot(self, frozen):
+            self._compacting.release()
+
+    Interrupted(path)._journal.close()
+
+    reopened = JournalSessionStore(path)
+    assert reopened.load_all() == {"sara": {"turn": 1}, "omar": {"turn": 2}}
+    reopened.close()
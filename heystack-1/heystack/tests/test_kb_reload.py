@@ -0,0 +1,24 @@
+from knowledge import KnowledgeBase
+
+MAQAM = "A maqam is a system of melodic modes used in Arabic music."
+STRINGS = "The oud has eleven strings in five courses."
+
+
+def test_reload_compacts_the_term_table(tmp_path):
+    (tmp_path / "a.txt").write_text(MAQAM + "\n", encoding="utf-8")
+    kb = KnowledgeBase(str(tmp_path), "tfidf").load()
+
+    for i in range(5):  # every reload replaces the whole vocabulary
+        (tmp_path / "a.txt").write_text(f"{STRINGS} Revision number{i}.\n", encoding="utf-8")
+        assert kb.reload(force=True)["reloaded"]
+    assert sorted(kb._terms) == sorted(KnowledgeBase(str(tmp_path), "tfidf").load()._terms)
+    assert len(kb._term_ids) == len(kb._terms)
+    assert "maqam" not in kb._term_ids and "number0" not in kb._term_ids
+    assert len(kb.retriever.vocabulary) == len(kb._terms)
+    assert kb.retrieve("eleven strings", top_k=1) == [f"{STRINGS} Revision number4."]
+    assert kb.retrieve("maqam", top_k=1) == []
+
+    (tmp_path / "b.txt").write_text(MAQAM + "\n", encoding="utf-8")
+    kb.reload()
+    assert kb.retrieve("melodic maqam", top_k=1) == [MAQAM]
+    assert kb.retrieve("eleven strings", top_k=1) == [f"{STRINGS} Revision number4."]
@@ -0,0 +1,66 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+import action
+from kb_loader import StaleChunk, scan
+from knowledge import KnowledgeBase
+from retrieval_pool import RetrievalPool
+
+QUESTION = "what is a maqam"  # no flow answers it once the name is known: knowledge-base fallback
+MAQAM = "A maqam is a system of melodic modes used in Arabic music.\n"
+
+
+@pytest.fixture
+def kb_dir(tmp_path):
+    (tmp_path / "maqam.txt").write_text(MAQAM + "\nThe oud has eleven strings in five courses.\n", encoding="utf-8")
+    return tmp_path
+
+
+def test_rewritten_source_raises_stale_chunk(kb_dir):
+    store = scan(str(kb_dir))
+    assert store[0] == MAQAM.strip()
+    (kb_dir / "maqam.txt").write_text("short\n", encoding="utf-8")
+    with pytest.raises(StaleChunk):
+        store[1]
+
+
+def test_deleted_or_edited_source_is_a_miss(kb_dir):
+    kb = KnowledgeBase(str(kb_dir), "tfidf").load()
+    assert kb.retrieve("maqam melodic modes", top_k=1) == [MAQAM.strip()]
+    path = kb_dir / "maqam.txt"
+    os.remove(path)
+    assert kb.retrieve("maqam modes", top_k=1) == []
+    path.write_text(MAQAM.upper(), encoding="utf-8")
+    assert kb.retrieve("maqam system", top_k=1) == []
+    assert kb.stale_reads == 2
+    kb.reload()
+    assert kb.retrieve("maqam system", top_k=1) == [MAQAM.upper().strip()]
+
+
+def test_unreadable_kb_answers_with_fallback(monkeypatch):
+    def lookup(*args):
+        raise FileNotFoundError("maqam.txt")
+
+    pool = RetrievalPool(lookup, workers=1)
+    monkeypatch.setattr(action, "RETRIEVAL_POOL", pool)
+    monkeypatch.setattr(action, "retrieve_many", lookup)
+    monkeypatch.setattr(action, "retrieval_ready", lambda: True)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=action.app), base_url="http://test") as client:
+            for message in ("", "Omar"):
+                assert (await client.post("/chat", json={"sender": "kb-gone", "message": message})).status_code == 200
+            response = await client.post("/chat", json={"sender": "kb-gone", "message": QUESTION})
+            assert response.status_code == 200
+            assert action.FALLBACK_REPLY in str(response.json())
+            response = await client.post("/chat/batch", json=[{"sender": "kb-gone", "message": QUESTION}])
+            assert response.status_code == 200
+            assert action.FALLBACK_REPLY in str(response.json())
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        pool.close()
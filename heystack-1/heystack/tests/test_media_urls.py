@@ -0,0 +1,22 @@
+import asyncio
+
+import httpx
+
+import action
+from media import MEDIA
+
+PICTURE = "static/images/Oud_Picture_1.webp"
+
+
+def test_reply_urls_are_rooted_at_the_mount_and_served():
+    url = MEDIA.url(PICTURE)
+    assert url.startswith(MEDIA.mount_path + "/") and url != f"{MEDIA.mount_path}/{PICTURE}"
+    assert MEDIA.unversioned(f'<img src="{url}">') == f'<img src="{PICTURE}">'
+
+    async def fetch():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=action.app), base_url="http://test") as client:
+            return await client.get(url)
+
+    response = asyncio.run(fetch())
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
@@ -0,0 +1,43 @@
+import time
+
+from knowledge import KnowledgeBase, ResultCache
+
+OLD = "The oud has eleven strings."
+NEW = "The oud has thirteen strings on some modern instruments."
+
+
+def test_reload_invalidates_cached_answers(tmp_path):
+    (tmp_path / "oud.txt").write_text(OLD + "\n", encoding="utf-8")
+    kb = KnowledgeBase(str(tmp_path), "tfidf").load()
+    assert kb.retrieve("oud strings", top_k=1) == [OLD]
+    assert kb.retrieve("  Oud   STRINGS ", top_k=1) == [OLD]  # same normalised question
+    assert kb.cache.stats()["hits"] == 1
+
+    (tmp_path / "oud.txt").write_text(NEW + "\n", encoding="utf-8")
+    version = kb.version
+    kb.reload()
+    assert kb.version == version + 1
+    assert kb.cache.stats()["entries"] == 0
+    assert kb.retrieve("oud strings", top_k=1) == [NEW]
+    assert kb.retrieve_many(["oud strings", "modern oud"], top_k=1) == [[NEW], [NEW]]
+
+
+def test_entry_from_an_older_version_is_never_served():
+    cache = ResultCache()
+    # A lookup that started on version 1 finishes after version 2 was published
+    cache.put(("oud strings", 2), 1, [0])
+    assert cache.get(("oud strings", 2), 2) is None
+    assert cache.stats()["misses"] == 1 and cache.stats()["entries"] == 0
+    cache.put(("oud strings", 2), 2, [3])
+    assert cache.get(("oud strings", 2), 2) == [3]
+
+
+def test_ttl_and_size_bound():
+    cache = ResultCache(max_entries=2, ttl=0.05)
+    for i in range(3):
+        cache.put((f"q{i}", 2), 1, [i])
+    assert cache.get(("q0", 2), 1) is None  # least recently used, evicted
+    assert cache.get(("q2", 2), 1) == [2]
+    time.sleep(0.06)
+    assert cache.get(("q2", 2), 1) is None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+
+import pytest
+
+from retrieval_pool import PoolBusy, RetrievalPool
+
+
+def blocking_lookup(release: threading.Event) -> str:
+    release.wait(5)
+    return "answer"
+
+
+def test_cancelled_callers_release_their_slots():
+    async def scenario():
+        pool = RetrievalPool(blocking_lookup, workers=2, max_pending=3)
+        release = threading.Event()
+        callers = [asyncio.create_task(pool.run(release)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        # The lookups are still running (shielded), so they still count against the limit
+        assert pool.in_flight == 3
+        with pytest.raises(PoolBusy):
+            await pool.run(release)
+
+        release.set()
+        for _ in range(100):
+            if not pool.in_flight:
+                break
+            await asyncio.sleep(0.01)
+        assert pool.in_flight == 0
+        assert pool.stats()["cancelled"] == 3
+        assert await pool.run(release) == "answer"
+        pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_timed_out_callers_release_their_slots():
+    async def scenario():
+        pool = RetrievalPool(blocking_lookup, workers=1, max_pending=2, timeout=0.05)
+        release = threading.Event()
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.run(release)
+        assert pool.in_flight == 1
+        release.set()
+        await asyncio.sleep(0.1)
+        assert pool.in_flight == 0
+        pool.close()
+
+    asyncio.run(scenario())
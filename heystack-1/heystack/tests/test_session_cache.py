@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import time
+
+import action
+from session_store import SessionCache, SessionStore
+
+
+class DictStore(SessionStore):
+    def __init__(self):
+        self.sessions = {}
+        self.load_threads = []
+
+    def load(self, sender_id):
+        self.load_threads.append(threading.get_ident())
+        return self.sessions.get(sender_id)
+
+    def save(self, sender_id, session):
+        self.sessions[sender_id] = dict(session)
+
+
+def test_sweep_expires_idle_sessions_without_new_senders():
+    store = DictStore()
+    cache = SessionCache(store, ttl=0.05, sweep_interval=0.02)
+    try:
+        cache.put("sara", {"turn": 1})
+        for _ in range(100):
+            if "sara" not in cache:
+                break
+            time.sleep(0.01)
+        assert "sara" not in cache
+        assert store.sessions == {"sara": {"turn": 1}}
+        assert cache.stats()["evictions"] == 1
+    finally:
+        cache.close()
+
+
+def test_cache_miss_loads_off_the_event_loop(monkeypatch):
+    store = DictStore()
+    store.sessions["sara"] = {"user_name": "Sara"}
+    monkeypatch.setattr(action, "SESSIONS", SessionCache(store))
+    monkeypatch.setattr(action, "SHARED_SESSIONS", False)
+
+    async def scenario():
+        first, _ = await action.load_session("sara")
+        again, _ = await action.load_session("sara")
+        return first, again, threading.get_ident()
+
+    first, again, loop_thread = asyncio.run(scenario())
+    assert first == again == {"user_name": "Sara"}
+    assert len(store.load_threads) == 1 and store.load_threads[0] != loop_thread
@@ -0,0 +1,36 @@
+import sqlite3
+import threading
+
+from session_store import VersionedSQLiteSessionStore
+
+
+def test_workers_starting_together_migrate_the_schema_once(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # The schema SQLiteSessionStore writes: no version column yet
+    conn.execute("CREATE TABLE sessions (sender TEXT PRIMARY KEY, data TEXT NOT NULL)")
+    conn.execute("INSERT INTO sessions VALUES ('sara', '{\"turn\": 1}')")
+    conn.commit()
+    conn.close()
+
+    workers = 8
+    start = threading.Barrier(workers)
+    stores, errors = [], []
+
+    def worker():
+        start.wait()
+        try:
+            stores.append(VersionedSQLiteSessionStore(path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert stores[0].load_versioned("sara") == ({"turn": 1}, 0)
+    for store in stores:
+        store.close()
@@ -0,0 +1,54 @@
+import json
+import threading
+
+from session_store import SQLiteSessionStore
+
+
+def test_saves_in_one_window_share_a_commit(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), commit_window=0.2)
+    start = threading.Barrier(20)
+
+    def turn(i):
+        start.wait()
+        store.save(f"sender-{i}", {"turn": i, "user_name": "سارة"})
+
+    threads = [threading.Thread(target=turn, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Queued but not committed yet: load() still sees the latest save
+    assert store.load("sender-3") == {"turn": 3, "user_name": "سارة"}
+    store.flush()
+    assert store.commits == 1
+    assert store.bytes_written == sum(len(json.dumps({"turn": i, "user_name": "سارة"}, ensure_ascii=False)
+                                          .encode("utf-8")) for i in range(20))
+    store.close()
+
+
+def test_later_save_in_the_window_replaces_the_earlier_one(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path, commit_window=0.05)
+    store.save("sara", {"turn": 1})
+    store.save("sara", {"turn": 2})
+    store.save_many([("omar", {"turn": 1}), ("sara", {"turn": 3})])
+    store.close()  # flushes what is queued
+
+    reopened = SQLiteSessionStore(path)
+    assert reopened.load_all() == {"sara": {"turn": 3}, "omar": {"turn": 1}}
+    assert reopened.load("nobody") is None
+    reopened.close()
+
+
+def test_imports_the_json_file_only_into_an_empty_table(tmp_path):
+    legacy = tmp_path / "chat_memory.json"
+    legacy.write_text(json.dumps({"sara": {"user_name": "Sara"}}), encoding="utf-8")
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path, import_from=str(legacy))
+    assert store.load("sara") == {"user_name": "Sara"}
+    store.save("sara", {"user_name": "Sara", "turn": 2})
+    store.close()
+
+    reopened = SQLiteSessionStore(path, import_from=str(legacy))
+    assert reopened.load("sara") == {"user_name": "Sara", "turn": 2}
+    reopened.close()
@@ -0,0 +1,18 @@
+import glob
+import json
+import os
+
+import pytest
+
+from replay import replay
+
+TRANSCRIPTS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "transcripts", "*.json")))
+
+
+@pytest.mark.parametrize("path", TRANSCRIPTS, ids=os.path.basename)
+def test_transcript_replays(path):
+    with open(path, "r", encoding="utf-8") as f:
+        transcript = json.load(f)
+    failures, _ = replay(transcript)
+    assert not failures, "\n".join(f"turn {i} {user!r}\n  expected: {expected}\n  actual:   {actual}"
+                                   for i, user, expected, actual in failures)